@@ -5,7 +5,8 @@ sys.path.append('..')
 
 from taskit.log import FileLogger, INFO, ERROR
 from taskit.simple import taskit
-from taskit.resync import Mediator, Resyncer, ResyncWaitTimeout
+from taskit.resync import (Mediator, Resyncer, ResyncWaitTimeout, Channel, 
+                           ResyncPool, as_completed)
 
 
 mediator = Mediator()
@@ -21,6 +22,17 @@ def error_maker():
     raise ValueError('Why *did* you call this!?')
 
 
+def inverse(x):
+    return 1. / x
+
+
+@taskit
+def producer(channel, n):
+    for i in range(n):
+        channel.put(i)
+    channel.close()
+
+
 def main():
     log = FileLogger(sys.stdout)
     
@@ -60,6 +72,29 @@ def main():
     log(INFO, 'Getting the result')
     log(INFO, resync.get())
     log(INFO, '------')
+    
+    log(INFO, 'Creating a ResyncPool with 4 workers')
+    pool = ResyncPool(4)
+    log(INFO, 'Starting 8 Resyncers for time.sleep() on the pool')
+    resyncs = [Resyncer(time.sleep, i / 10.) for i in (4, 3, 2, 1, 8, 7, 6, 5)]
+    for resync in resyncs:
+        resync.start(pool)
+    log(INFO, 'Waiting for them in the order that they complete')
+    for resync in as_completed(resyncs):
+        log(INFO, 'Slept for %ss' % resync.args[0])
+    log(INFO, 'Mapping inverse() over [4, 2, 0, 1] on the pool. The error '
+              'for 0 is returned rather than raised:')
+    log(INFO, list(pool.map(inverse, [4, 2, 0, 1], return_errors=True)))
+    pool.close()
+    log(INFO, '------')
+    
+    log(INFO, 'Creating a Channel holding up to 10 values')
+    channel = Channel(10)
+    log(INFO, 'Starting producer(channel, 100)')
+    producer.ignore(channel, 100)
+    log(INFO, 'Summing everything in the channel until it is closed')
+    log(INFO, sum(channel))
+    log(INFO, '------')
 
 
 if __name__ == '__main__':
@@ -4,17 +4,23 @@ import sys
 sys.path.append('..')
 
 from taskit.backend import BackEnd, ADMIN_TASKS
+from taskit.common import CompressedCodec, BinaryCodec
 
 
 def add(x, y):
     return x + y
 def echo(s):
     return s
+def fib(n):
+    return n if n < 2 else fib(n - 1) + fib(n - 2)
 
 
 tasks = dict(ADMIN_TASKS)
-tasks.update(dict(add=add, echo=echo))
-backend = BackEnd(tasks)
+tasks.update(dict(add=add, echo=echo, fib=fib))
+tasks['fib_memo'] = (fib, False, {'memoize': True})
+# Also serves clients that don't compress, and those that shake hands on the 
+# binary codec.
+backend = BackEnd(tasks, codec=CompressedCodec(), codecs=[BinaryCodec])
 
 
 def main():
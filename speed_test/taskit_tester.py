@@ -4,14 +4,19 @@ import timeit
 import sys
 sys.path.append('..')
 
-from taskit.frontend import FrontEnd
+from taskit.frontend import FrontEnd, Blob
+from taskit.common import CompressedCodec, BinaryCodec
 
 
 bigstring = '4' * 3000
+bigblob = Blob(bigstring)
 num = 10000
 
 backend = sys.argv[1] if len(sys.argv) > 1 else 'localhost'
 frontend = FrontEnd([backend])
+prepared_add = frontend.prepare('add')
+compressed = FrontEnd([backend], codec=CompressedCodec(), protocol=2)
+binary = FrontEnd([backend], codecs=[BinaryCodec])
 
 
 def local_1_sub(x, y):
@@ -28,6 +33,20 @@ def remote_1():
     frontend.work('add', 4, 4)
 def remote_2():
     frontend.work('echo', bigstring)
+def remote_3():
+    compressed.work('echo', bigstring)
+def remote_4():
+    binary.work('add', 4, 4)
+def remote_5():
+    binary.work('echo', bigstring)
+def remote_6():
+    prepared_add(4, 4)
+def remote_7():
+    frontend.work('echo', bigblob)
+def remote_8():
+    frontend.work('fib', 15)
+def remote_9():
+    frontend.work('fib_memo', 15)
 
 
 def main():
@@ -35,8 +54,15 @@ def main():
     print('-- Remote host is %r' % backend)
     print('(control) add, no-delay  -->', timeit.timeit(local_1, number=num))
     print('(remote) add, no-delay   -->', timeit.timeit(remote_1, number=num))
+    print('(remote) add, prepared   -->', timeit.timeit(remote_6, number=num))
     print('(control) echo, no-delay -->', timeit.timeit(local_2, number=num))
     print('(remote) echo, no-delay  -->', timeit.timeit(remote_2, number=num))
+    print('(remote) echo, zlib      -->', timeit.timeit(remote_3, number=num))
+    print('(remote) add, binary     -->', timeit.timeit(remote_4, number=num))
+    print('(remote) echo, binary    -->', timeit.timeit(remote_5, number=num))
+    print('(remote) echo, blob      -->', timeit.timeit(remote_7, number=num))
+    print('(remote) fib, no-delay   -->', timeit.timeit(remote_8, number=num))
+    print('(remote) fib, memoized   -->', timeit.timeit(remote_9, number=num))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,1198 @@
+"""
+asyncio versions of the distributed TaskIt classes. Python 3 only.
+
+These speak exactly the same protocol as their threaded counterparts, using 
+the same codecs and FirstBytes framing, so they can be mixed freely with them.
+"""
+
+import time
+import asyncio
+import inspect
+import functools
+import itertools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from .common import *
+from .log import *
+from .backend import (BackEnd, END_RESP, BATCH_SIZE, BATCH_WAIT, 
+                      STREAM_CHUNK, STREAM_BUFFER, BlobMissingError, 
+                      ResultCache, _SIGNALS, _batch_results, _is_stream, 
+                      _take, _has_blobs, _memo_key)
+from .frontend import (BackendNotAvailableError, BackendBusyError, 
+                       BackendProcessingError, FrontEnd, Blob, Streamed, 
+                       DOWN_LOAD, CHUNKSIZE, _encoded, _has_special)
+
+
+__all__ = ['AsyncFrontEnd', 'AsyncBackEnd']
+
+WORKERS = 16
+
+
+async def recv_message(protocol, reader):
+    """
+    Receive a FirstBytes message from the asyncio StreamReader `reader`, 
+    returning a (version, data) pair just like 
+    `FirstBytesProtocol.recv_message()`.
+    """
+    header_size = protocol.first + 1
+    pieces = []
+    while 1:
+        try:
+            header = await reader.readexactly(header_size)
+            version, size, last = protocol._header(header)
+            pieces.append(await reader.readexactly(size))
+        except asyncio.IncompleteReadError:
+            raise FirstBytesCorruptionError(
+              'Socket connection or remote codebase is broken!')
+        if last:
+            return version, protocol._join(version, pieces)
+
+
+def write_message(protocol, writer, data, version=None):
+    """
+    Queue up a FirstBytes message on the asyncio StreamWriter `writer`. The 
+    whole message is written at once, so messages from different coroutines 
+    never interleave; the caller should drain() the writer afterwards.
+    """
+    for buffers in protocol._articles(data, version):
+        writer.writelines(buffers)
+
+
+class _Connection(object):
+    
+    """
+    The asyncio counterpart to `MultiplexedConnection()`: a connection shared 
+    by many concurrent requests, with a reader task handing each response to 
+    the future waiting on its request id. The messages of a streamed response 
+    go to a queue instead.
+    """
+    
+    def __init__(self, frontend, reader, writer, codec, version):
+        self.frontend = frontend
+        self.reader = reader
+        self.writer = writer
+        self.codec = codec
+        self.version = version
+        self.waiters = {}
+        self.partial = {}
+        self.broken = None
+        self.last_used = time.time()
+        self.drain_lock = asyncio.Lock()
+        self.reader_task = asyncio.ensure_future(self._reader())
+    
+    def __len__(self):
+        return len(self.waiters)
+    
+    async def _reader(self):
+        fe = self.frontend
+        try:
+            while 1:
+                version, incoming = await recv_message(fe, self.reader)
+                fe.log(DEBUG, incoming)
+                result = self.codec.decode(incoming)
+                rid = result[-1]
+                try:
+                    if result[0] == 'yield':
+                        waiter = self.waiters[rid]
+                    else:
+                        waiter = self.waiters.pop(rid)
+                except (KeyError, TypeError):
+                    raise FirstBytesCorruptionError(
+                      'Response does not match any request -- does the '
+                      'backend support multiplexing?')
+                
+                if isinstance(waiter, asyncio.Queue):
+                    waiter.put_nowait(result[:-1])
+                elif result[0] == 'yield':
+                    self.partial.setdefault(rid, []).extend(result[1])
+                else:
+                    items = self.partial.pop(rid, None)
+                    if items is not None and result[0] == 'success':
+                        result = ['success', items, rid]
+                    if not waiter.done():
+                        waiter.set_result(result[:-1])
+        except Exception as e:
+            self._break(e)
+        except asyncio.CancelledError:
+            self._break(OSError('Connection closed by the client'))
+            raise
+    
+    def _break(self, e):
+        if self.broken is None:
+            self.broken = e
+        waiters, self.waiters = self.waiters, {}
+        self.partial = {}
+        self.writer.close()
+        for waiter in waiters.values():
+            if isinstance(waiter, asyncio.Queue):
+                # Streams get the error itself as their last message.
+                waiter.put_nowait(e)
+            elif not waiter.done():
+                waiter.set_exception(e)
+    
+    async def _send(self, rid, package, waiter):
+        """
+        Send `package`, packaged with the request id `rid`, registering 
+        `waiter` for the response.
+        """
+        if self.broken is not None:
+            raise self.broken
+        self.waiters[rid] = waiter
+        self.last_used = time.time()
+        try:
+            write_message(self.frontend, self.writer, 
+                          _encoded(package, self.codec), self.version)
+            async with self.drain_lock:
+                await self.writer.drain()
+        except Exception as e:
+            self._break(e)
+            raise
+    
+    async def request(self, rid, package):
+        """
+        Send `package`, packaged with the request id `rid`, and wait for the 
+        decoded response (without the id).
+        """
+        future = asyncio.get_event_loop().create_future()
+        await self._send(rid, package, future)
+        return await future
+    
+    async def request_stream(self, rid, package):
+        """
+        Send `package`, packaged with the request id `rid`, and return a queue 
+        that will receive each decoded message of the response (without the 
+        id), or the error that broke the connection.
+        """
+        queue = asyncio.Queue()
+        await self._send(rid, package, queue)
+        return queue
+    
+    def close(self):
+        self.reader_task.cancel()
+
+
+class _Coalescer(object):
+    
+    """
+    An event loop version of `taskit.frontend.Coalescer()`.
+    """
+    
+    def __init__(self, frontend, wait, size):
+        self.frontend = frontend
+        self.wait = wait
+        self.size = size
+        self.calls = []
+        self.futures = []
+        self.timer = None
+        # Keep references to the sending tasks; the event loop doesn't.
+        self.sending = set()
+    
+    def _flush(self):
+        """
+        Send the waiting calls.
+        """
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        calls, futures = self.calls, self.futures
+        self.calls, self.futures = [], []
+        task = asyncio.ensure_future(self._send(calls, futures))
+        self.sending.add(task)
+        task.add_done_callback(self.sending.discard)
+    
+    async def _send(self, calls, futures):
+        try:
+            responses = await self.frontend._work_routed(BATCH, [calls], {})
+        except Exception as e:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for future, res in zip(futures, responses):
+            if future.done():
+                # The caller was cancelled.
+                continue
+            if res[0] == 'success':
+                future.set_result(res[1])
+            else:
+                future.set_exception(BackendProcessingError(*res[1:]))
+    
+    def call(self, task, args, kw):
+        """
+        Add a call to the batch, returning a future for its result.
+        """
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        self.calls.append([task, list(args), kw])
+        self.futures.append(future)
+        if len(self.calls) >= self.size:
+            self._flush()
+        elif self.timer is None:
+            self.timer = loop.call_later(self.wait, self._flush)
+        return future
+
+
+def _refuse_streamed(args, kw):
+    """
+    Helper function to reject the Streamed() arguments of a call, which 
+    AsyncFrontEnd() can't send.
+    """
+    if _has_special(args, kw, Streamed):
+        raise TypeError('Streamed() arguments are not supported by '
+                        'AsyncFrontEnd(); use a FrontEnd()')
+
+
+class AsyncFrontEnd(FrontEnd):
+    
+    """
+    A TaskIt DTPM client for asyncio programs. The interface is that of 
+    `FrontEnd()`, except that work(), send_signal(), send_stop(), send_kill() 
+    and get_tasks() are coroutines, and submit(), callback() and ignore() 
+    schedule a task on the running event loop instead of using threads.
+    
+    Requests are always multiplexed, with up to `pool_size` connections to 
+    each backend, so any number of calls may be in flight at once from one 
+    event loop. Backends must support multiplexed requests.
+    
+    Streamed() arguments aren't supported; calls with them raise a TypeError 
+    before anything is sent, so uploads must go through a `FrontEnd()`.
+    """
+    
+    def __init__(self, *args, **kw):
+        """
+        Takes the same arguments as `FrontEnd()`. `multiplex` is ignored.
+        """
+        self.monitor_task = None
+        FrontEnd.__init__(self, *args, **kw)
+        self.multiplex = True
+        self.connect_locks = {}
+        if self.coalescer is not None:
+            self.coalescer = _Coalescer(self, self.coalescer.wait, 
+                                        self.coalescer.size)
+    
+    async def _shared_connection(self, backend):
+        """
+        Used internally to pick the least busy connection to `backend`, 
+        opening a new one if they are all busy and there is room, and closing 
+        ones that have been idle for too long.
+        """
+        limit = max(self.pool_size, 1)
+        cutoff = time.time() - self.pool_idle
+        conns = []
+        for conn in self.shared.get(backend, ()):
+            if conn.broken is not None:
+                continue
+            if not len(conn) and conn.last_used < cutoff:
+                conn.close()
+            else:
+                conns.append(conn)
+        self.shared[backend] = conns
+        best = min(conns, key=len) if conns else None
+        if best is not None and (not len(best) or len(conns) >= limit):
+            return best
+        
+        # Only one coroutine connects at a time; the others will likely be 
+        # happy with the result.
+        lock = self.connect_locks.get(backend)
+        if lock is None:
+            lock = self.connect_locks[backend] = asyncio.Lock()
+        async with lock:
+            conns = self.shared[backend]
+            best = min(conns, key=len) if conns else None
+            if best is not None and (not len(best) or len(conns) >= limit):
+                return best
+            reader, writer = await asyncio.open_connection(*backend)
+            pool = self.pools[backend]
+            if pool.handshake is not None:
+                try:
+                    await self._shake_hands(pool, reader, writer)
+                except BaseException:
+                    writer.close()
+                    raise
+                if pool.handshake is None:
+                    # Turned down; start over, as in ConnectionPool.connect().
+                    writer.close()
+                    reader, writer = await asyncio.open_connection(*backend)
+            conn = _Connection(self, reader, writer, pool.codec, 
+                               pool.version)
+            # The list may have been replaced while we were connecting.
+            self.shared[backend].append(conn)
+            return conn
+    
+    async def _shake_hands(self, pool, reader, writer):
+        """
+        Used internally to open a new connection with a HELLO handshake. See 
+        `FrontEnd._hello()`.
+        """
+        write_message(self, writer, 
+                      self.codec.encode([HELLO, [self.offers, [1, 2]], {}]))
+        await writer.drain()
+        version, incoming = await recv_message(self, reader)
+        self._agreed(pool, self.codec.decode(incoming))
+    
+    async def _work(self, backend, package, ident='', log=True, rid=None):
+        """
+        Centralized task worker code. Used internally, see send_signal() and 
+        work() for the external interfaces.
+        """
+        num = self._sending_task(backend)
+        log = log and self.log is not null_logger
+        if log:
+            self.log(INFO, 'Starting %s backend task #%s (%s)' %
+                           (backend, num, ident))
+        try:
+            conn = await self._shared_connection(backend)
+            result = await conn.request(rid, package)
+        except BaseException as e:
+            self._canceling_task(backend)
+            if isinstance(e, OSError):
+                self._failed(backend)
+            raise
+        else:
+            self._closing_task(backend)
+            self.breakers[backend].succeeded()
+            if log:
+                self.log(INFO, 'Finished %s backend task #%s (%s)' %
+                               (backend, num, ident))
+        
+        if result[0] == 'error':
+            if result[1] == BUSY:
+                raise BackendBusyError
+            # We reraise errors in our own way.
+            raise BackendProcessingError(*result[1:])
+        else:
+            return result[1]
+    
+    async def _do_cb(self, task, cb, error_cb, *args, **kw):
+        """
+        Called internally by callback(). Does cb and error_cb selection.
+        """
+        try:
+            res = await self.work(task, *args, **kw)
+        except BackendProcessingError as e:
+            if error_cb is None:
+                show_err()
+            elif error_cb:
+                error_cb(e)
+        else:
+            # Success, let's call away!
+            cb(res)
+    
+    async def send_signal(self, backend, signal):
+        """
+        Sends the `signal` signal to `backend`. Raises ValueError if `backend` 
+        is not registered with the client. Returns the result.
+        """
+        backend = self._expand_host(backend)
+        if backend in self.backends:
+            rid = self._next_id()
+            try:
+                return await self._work(backend,
+                                        self._package(signal, rid=rid),
+                                        log=False, rid=rid)
+            except OSError:
+                raise BackendNotAvailableError
+        else:
+            raise ValueError('No such backend!')
+    
+    async def send_stop(self, backend):
+        """
+        Sends the STOP signal to `backend`.
+        """
+        await self.send_signal(backend, STOP)
+    
+    async def send_kill(self, backend):
+        """
+        Sends the KILL signal to `backend`.
+        """
+        await self.send_signal(backend, KILL)
+    
+    async def send_flush(self, backend):
+        """
+        Sends the FLUSH signal to `backend`.
+        """
+        await self.send_signal(backend, FLUSH)
+    
+    async def get_stats(self, backend):
+        """
+        Gets a dict of statistics from `backend`, or None if the backend is 
+        down. See `FrontEnd.get_stats()`.
+        """
+        try:
+            return await self.send_signal(backend, STATS)
+        except BackendNotAvailableError:
+            return None
+    
+    async def get_tasks(self, backend):
+        """
+        Gets a string of the tasks running on `backend`, or 'down'. See 
+        `FrontEnd.get_tasks()`.
+        """
+        try:
+            res = await self.send_signal(backend, STATUS)
+        except BackendNotAvailableError:
+            res = 'down'
+        return res
+    
+    async def work(self, task, *args, **kw):
+        """
+        Handles pushing out the task and getting the response. See 
+        `FrontEnd.work()`.
+        """
+        if self.coalescer is not None and not _has_special(args, kw):
+            return await self.coalescer.call(task, args, kw)
+        return await self._work_routed(task, args, kw)
+    
+    async def _work_routed(self, task, args, kw):
+        """
+        Used internally to run a task on the best backend that will take it. 
+        See work().
+        """
+        _refuse_streamed(args, kw)
+        call = None
+        if _has_special(args, kw, Blob):
+            call = args, kw
+            args, kw = self._placeholders(args, kw, [])
+        rid = self._next_id()
+        return await self._route(task, self._package(task, args, kw, rid), 
+                                 rid, call=call)
+    
+    async def _route(self, task, package, rid=None, uploads=(), call=None):
+        """
+        Used internally to send `package`, a call to `task` packaged with the 
+        request id `rid`, to the best backend that will take it. See 
+        `FrontEnd._route()`.
+        """
+        if self.monitor_interval and self.monitor_task is None:
+            self._start_monitor_task()
+        
+        for backend in self._choose():
+            try:
+                try:
+                    return await self._work(backend, package, task, rid=rid)
+                except BackendProcessingError as e:
+                    if e.type != MISSING_BLOB or call is None:
+                        raise
+                args, kw = self._placeholders(call[0], call[1], [], True)
+                rid = self._next_id()
+                package = self._package(task, args, kw, rid)
+                return await self._work(backend, package, task, rid=rid)
+            except (OSError, BackendBusyError):
+                # We want to just move onto the next backend if we couldn't 
+                # connect to this one, or if it is too busy
+                pass
+        # Didn't not get a backend, let the caller know!
+        raise BackendNotAvailableError
+    
+    async def starmap(self, task, iterable, chunksize=CHUNKSIZE, 
+                      ordered=True, return_errors=False):
+        """
+        An async generator version of `FrontEnd.starmap()`.
+        """
+        chunks = self._chunks(task, iterable, chunksize)
+        window = max(2 * len(self.backend_list), 2)
+        running = {}
+        finished = {}
+        sent = 0
+        wanted = 0
+        for chunk in itertools.islice(chunks, window):
+            running[asyncio.ensure_future(
+              self._work_routed(BATCH, [chunk], {}))] = sent
+            sent += 1
+        try:
+            while running:
+                done, pending = await asyncio.wait(
+                  running, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    index = running.pop(future)
+                    for chunk in itertools.islice(chunks, 1):
+                        running[asyncio.ensure_future(
+                          self._work_routed(BATCH, [chunk], {}))] = sent
+                        sent += 1
+                    finished[index] = future.result()
+                if not ordered:
+                    ready, finished = list(finished.values()), {}
+                else:
+                    ready = []
+                    while wanted in finished:
+                        ready.append(finished.pop(wanted))
+                        wanted += 1
+                for responses in ready:
+                    for res in self._unpack_batch(responses, return_errors):
+                        yield res
+        finally:
+            for future in running:
+                future.cancel()
+    
+    def map(self, task, iterable, chunksize=CHUNKSIZE, ordered=True, 
+            return_errors=False):
+        """
+        An async generator version of `FrontEnd.map()`:
+          async for res in frontend.map('add1', range(1000)):
+        """
+        return self.starmap(task, ((arg,) for arg in iterable), chunksize, 
+                            ordered, return_errors)
+    
+    async def stream(self, task, *args, **kw):
+        """
+        An async generator version of `FrontEnd.stream()`:
+          async for item in frontend.stream('scan', 'users'):
+        """
+        _refuse_streamed(args, kw)
+        if _has_special(args, kw, Blob):
+            args, kw = self._placeholders(args, kw, [], True)
+        rid = self._next_id()
+        package = self._package(task, args, kw, rid)
+        for backend in self._choose():
+            num = self._sending_task(backend)
+            self.log(INFO, 'Starting %s backend stream #%s (%s)' % 
+                           (backend, num, task))
+            try:
+                conn = await self._shared_connection(backend)
+                queue = await conn.request_stream(rid, package)
+                message = await queue.get()
+                if isinstance(message, Exception):
+                    raise message
+            except BaseException as e:
+                self._canceling_task(backend)
+                if isinstance(e, OSError):
+                    self._failed(backend)
+                    continue
+                raise
+            if message[0] == 'error' and message[1] == BUSY:
+                self._closing_task(backend)
+                continue
+            
+            try:
+                while message[0] == 'yield':
+                    for item in message[1]:
+                        yield item
+                    message = await queue.get()
+                    if isinstance(message, Exception):
+                        raise message
+            except OSError:
+                self._canceling_task(backend)
+                self._failed(backend)
+                raise
+            except BaseException:
+                self._closing_task(backend)
+                raise
+            self._closing_task(backend)
+            self.breakers[backend].succeeded()
+            self.log(INFO, 'Finished %s backend stream #%s (%s)' % 
+                           (backend, num, task))
+            if message[0] == 'error':
+                raise BackendProcessingError(*message[1:])
+            if message[1] is not None:
+                for item in message[1]:
+                    yield item
+            return
+        raise BackendNotAvailableError
+    
+    def submit(self, task, *args, **kw):
+        """
+        Schedules the task on the running event loop, returning the asyncio 
+        task for its result.
+        """
+        return asyncio.ensure_future(self.work(task, *args, **kw))
+    
+    def callback(self, task, cb, error_cb, *args, **kw):
+        """
+        Schedules the task on the running event loop, then runs a callback on 
+        success or an error callback on fail. Returns the asyncio task.
+        
+        cb       -- The function to be called with a successful result. 
+        error_cb -- The function to be called when an error occurs.
+        
+        For information on `task`, *args, and **kw, see work().
+        """
+        return asyncio.ensure_future(
+          self._do_cb(task, cb, error_cb, *args, **kw))
+    
+    async def _poll_load(self, backend):
+        """
+        Used internally by the load monitor. See `FrontEnd._poll_load()`.
+        """
+        ours = self.backends[backend]
+        try:
+            try:
+                stats = await self.send_signal(backend, STATS)
+                load = stats['tasks'] + stats['queued']
+            except BackendProcessingError:
+                # Older backends don't know STATS.
+                load = int(await self.send_signal(backend, STATUS))
+        except BackendNotAvailableError:
+            return DOWN_LOAD
+        return max(load - 1 - ours, 0)
+    
+    async def _monitor(self):
+        """
+        The load monitor task. See `FrontEnd._monitor()`.
+        """
+        while 1:
+            for backend in list(self.backend_list):
+                try:
+                    load = await self._poll_load(backend)
+                except Exception as e:
+                    self.log(ERROR, 'Could not get the load of backend %s: %r' 
+                                    % (backend, e))
+                    self.remote_load.pop(backend, None)
+                else:
+                    self.remote_load[backend] = load
+            await asyncio.sleep(self.monitor_interval)
+    
+    def _start_monitor_task(self):
+        self.monitor_task = asyncio.ensure_future(self._monitor())
+    
+    def start_monitor(self, interval):
+        """
+        Start polling each backend for its load every `interval` seconds, in 
+        a task on the running event loop, or on the loop that the first call 
+        to work() is made from. See `FrontEnd.start_monitor()`.
+        """
+        self.stop_monitor()
+        self.monitor_interval = interval
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._start_monitor_task()
+    
+    def stop_monitor(self):
+        """
+        Stop the load monitor, and forget what it found out.
+        """
+        if self.monitor_task is not None:
+            self.monitor_task.cancel()
+            self.monitor_task = None
+        self.monitor_interval = None
+        self.remote_load = {}
+    
+    def close(self):
+        """
+        Close all connections, and stop the load monitor. The AsyncFrontEnd 
+        may still be used afterwards; new connections will be opened as 
+        needed.
+        """
+        self.stop_monitor()
+        shared, self.shared = self.shared, {}
+        for conns in shared.values():
+            for conn in conns:
+                conn.close()
+
+
+class _Client(object):
+    
+    """
+    Per-connection state kept by the AsyncBackEnd's connection handlers.
+    """
+    
+    def __init__(self, writer):
+        self.writer = writer
+        self.drain_lock = asyncio.Lock()
+        # Responses use the FirstBytes version of the last request.
+        self.version = 1
+        # The codec used on this connection, picked on its first request
+        self.codec = None
+        # The codec that the client works out Blob() digests with: the one it 
+        # started out in, before any HELLO
+        self.blob_codec = None
+        # The number of requests from this connection yet to be answered
+        self.pending = 0
+        # Closes the connection once it has been idle for `keep_alive`
+        self.timer = None
+
+
+class _Gatherer(object):
+    
+    """
+    An event loop version of the gatherer that makes concurrent calls to a 
+    batch task as one call. See the 'batch' option of `BackEnd()`.
+    """
+    
+    def __init__(self, backend, obj, options):
+        self.backend = backend
+        self.obj = obj
+        self.size = options.get('batch_size', BATCH_SIZE)
+        self.wait = options.get('batch_wait', BATCH_WAIT)
+        self.options = dict(options, batch=False)
+        self.arg_sets = []
+        self.futures = []
+        self.timer = None
+        self.running = set()
+    
+    def _flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        arg_sets, futures = self.arg_sets, self.futures
+        self.arg_sets, self.futures = [], []
+        task = asyncio.ensure_future(self._run(arg_sets, futures))
+        self.running.add(task)
+        task.add_done_callback(self.running.discard)
+    
+    async def _run(self, arg_sets, futures):
+        try:
+            results = await self.backend._call_batch(self.obj, arg_sets, 
+                                                     self.options)
+        except Exception as e:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for future, res in zip(futures, results):
+                if not future.done():
+                    future.set_result(res)
+    
+    def call(self, args):
+        """
+        Add a call to the batch, returning a future for its result.
+        """
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        self.arg_sets.append(args)
+        self.futures.append(future)
+        if len(self.arg_sets) >= self.size:
+            self._flush()
+        elif self.timer is None:
+            self.timer = loop.call_later(self.wait, self._flush)
+        return future
+
+
+class _AsyncArgStream(object):
+    
+    """
+    The async iterator that an `async def` task gets for a streamed argument. 
+    See `taskit.backend._ArgStream()`.
+    """
+    
+    def __init__(self):
+        self.chunks = deque()
+        self.items = iter(())
+        self.closed = False
+        self.error = None
+        self.changed = asyncio.Event()
+    
+    async def _wait(self, ready):
+        while not ready():
+            self.changed.clear()
+            await self.changed.wait()
+    
+    def __aiter__(self):
+        return self
+    
+    async def __anext__(self):
+        while 1:
+            for item in self.items:
+                return item
+            await self._wait(lambda: self.closed or self.chunks)
+            if not self.chunks:
+                if self.error is not None:
+                    raise self.error
+                raise StopAsyncIteration
+            self.items = iter(self.chunks.popleft())
+            self.changed.set()
+    
+    async def feed(self, items):
+        await self._wait(
+          lambda: self.closed or len(self.chunks) < STREAM_BUFFER)
+        if not self.closed:
+            self.chunks.append(items)
+            self.changed.set()
+    
+    def close(self, error=None):
+        self.closed = True
+        self.error = error
+        self.changed.set()
+
+
+class AsyncBackEnd(BackEnd):
+    
+    """
+    A TaskIt DTPM server running on an asyncio event loop. Tasks defined with 
+    `async def` are awaited right on the loop, and async generators are 
+    streamed from it; any other callables are run in a bounded thread pool. 
+    The task table and everything else work just as they do for `BackEnd()`.
+    """
+    
+    _gatherer_type = _Gatherer
+    
+    def __init__(self, tasks, host='127.0.0.1', port=DEFAULT_PORT,
+                 workers=WORKERS, **kw):
+        """
+        workers -- The number of threads used to run plain (not `async def`) 
+                   tasks. Calls beyond that will wait for a free thread; 
+                   `queue_size` and `overflow` do not apply.
+        
+        See `BackEnd()` for the other arguments.
+        """
+        BackEnd.__init__(self, tasks, host, port, **kw)
+        self.workers = workers
+        # The number of plain tasks handed to the executor and not yet done
+        self.sync_tasks = 0
+        # Keep references to running tasks; the event loop doesn't.
+        self.running = set()
+        self.clients = {}
+    
+    async def _handler(self, reader, writer):
+        """
+        Connection handler coroutine. See `BackEnd._handler()`.
+        """
+        loop = asyncio.get_event_loop()
+        client = _Client(writer)
+        self.clients[asyncio.current_task()] = writer
+        try:
+            while 1:
+                if self.keep_alive is not None:
+                    client.timer = loop.call_later(self.keep_alive, 
+                                                   self._expire, client)
+                try:
+                    client.version, incoming = await recv_message(self,
+                                                                  reader)
+                except (OSError, FirstBytesCorruptionError):
+                    # Closed, timed out, or broken; either way, we are done.
+                    break
+                if client.timer is not None:
+                    client.timer.cancel()
+                self.log(DEBUG, incoming)
+                if client.codec is None:
+                    client.codec = client.blob_codec = self._pick_codec(
+                      incoming)
+                try:
+                    request = client.codec.decode(incoming)
+                    multiplexed = len(request) > 3
+                except Exception as e:
+                    self.log(ERROR, 'Could not decode request: %r' % e)
+                    break
+                
+                if request[0] == HELLO:
+                    await self._hello(client, request)
+                    continue
+                if self.stop and request[0] not in _SIGNALS:
+                    await self._send_response(
+                      client, ['error', BUSY, ['The backend is stopping']], 
+                      request[3:])
+                    if request[0] == STREAM:
+                        break
+                    continue
+                client.pending += 1
+                self.started_task()
+                if request[0] == STREAM:
+                    if not await self._respond_streamed(client, reader, 
+                                                        request):
+                        break
+                elif multiplexed:
+                    task = asyncio.ensure_future(self._respond(client,
+                                                               request))
+                    self.running.add(task)
+                    task.add_done_callback(self.running.discard)
+                else:
+                    await self._respond(client, request)
+        finally:
+            if client.timer is not None:
+                client.timer.cancel()
+            writer.close()
+            del self.clients[asyncio.current_task()]
+    
+    def _expire(self, client):
+        """
+        Close the connection of `client`, which has been idle for 
+        `keep_alive` -- unless it still has requests running, as their 
+        responses are still to come; then it is checked again after as long.
+        """
+        if client.pending:
+            client.timer = asyncio.get_event_loop().call_later(
+              self.keep_alive, self._expire, client)
+        else:
+            client.writer.close()
+    
+    async def _respond(self, client, request):
+        """
+        Takes care of running the proper task or applying a signal for one 
+        request, and of sending the response back to the client.
+        """
+        task = None
+        try:
+            task, args, kw = request[:3]
+            if _has_blobs(args, kw):
+                args, kw = self._unpack_blobs(args, kw, client.blob_codec)
+            
+            self.log(INFO, 'Fulfilling task %r' % task)
+            obj, args, options = self._lookup(task, args)
+            res = ['success', await self._call(obj, args, kw, options)]
+            if inspect.isasyncgen(res[1]) or _is_stream(res[1]):
+                res = await self._stream(client, task, res[1], options, 
+                                         request[3:])
+        except BlobMissingError as e:
+            res = ['error', MISSING_BLOB, list(e.args)]
+        except Exception as e:
+            res = self._error(task, e)
+        else:
+            self.log(INFO, 'Finished fulfilling task %r' % task)
+        finally:
+            await self._send_response(client, res, request[3:])
+            client.pending -= 1
+            self.finished_task()
+    
+    async def _stream(self, client, task, iterator, options, tag):
+        """
+        Send the items of `iterator` as they are produced. See 
+        `BackEnd._stream()`. Async generators are run on the loop; plain 
+        iterators are advanced in the thread pool.
+        """
+        loop = asyncio.get_event_loop()
+        limit = options.get('stream_chunk', STREAM_CHUNK)
+        size = 1
+        while 1:
+            try:
+                if inspect.isasyncgen(iterator):
+                    items = []
+                    async for item in iterator:
+                        items.append(item)
+                        if len(items) >= size:
+                            break
+                else:
+                    items = await loop.run_in_executor(self.executor, _take, 
+                                                       iterator, size)
+            except Exception as e:
+                return self._error(task, e)
+            if not items:
+                return ['success', None]
+            if not await self._send_response(client, ['yield', items], tag):
+                # Nobody is listening any more.
+                if inspect.isasyncgen(iterator):
+                    await iterator.aclose()
+                else:
+                    close = getattr(iterator, 'close', None)
+                    if close is not None:
+                        close()
+                return ['success', None]
+            size = min(size * 2, limit)
+    
+    async def _hello(self, client, request):
+        """
+        Answer a HELLO handshake. See `BackEnd._hello()`.
+        """
+        name, version = self._agree(request)
+        await self._send_response(client, ['success', [name, version]])
+        if name is not None:
+            client.codec = self.codecs[name]
+    
+    async def _respond_streamed(self, client, reader, request):
+        """
+        Answer a STREAM request. See `BackEnd._respond_streamed()`; `async 
+        def` tasks get async iterators for their streamed arguments.
+        """
+        loop = asyncio.get_event_loop()
+        try:
+            obj = self._lookup(request[1][0], request[1][1])[0]
+        except Exception:
+            # _respond() will answer with the error.
+            obj = None
+        if (asyncio.iscoroutinefunction(obj) or 
+            inspect.isasyncgenfunction(obj)):
+            request, streams = self._open_streams(request, _AsyncArgStream)
+        else:
+            request, streams = self._open_streams(request)
+        
+        async def respond():
+            try:
+                await self._respond(client, request)
+            finally:
+                for stream in streams.values():
+                    stream.close()
+        response = asyncio.ensure_future(respond())
+        
+        remaining = set(streams)
+        try:
+            while remaining:
+                client.version, incoming = await recv_message(self, reader)
+                sid, items = client.codec.decode(incoming)
+                if sid not in remaining:
+                    raise FirstBytesCorruptionError(
+                      'Data for an unknown stream %r' % sid)
+                stream = streams[sid]
+                if items is None:
+                    remaining.discard(sid)
+                    stream.close()
+                elif isinstance(stream, _AsyncArgStream):
+                    await stream.feed(items)
+                else:
+                    # Plain tasks read their streams in a thread; waiting on 
+                    # them needs one too.
+                    await loop.run_in_executor(None, stream.feed, items)
+        except Exception as e:
+            self.log(ERROR, 'Streamed arguments broken off: %r' % e)
+            for stream in streams.values():
+                stream.close(e)
+            await response
+            return False
+        await response
+        return True
+    
+    async def _call(self, obj, args, kw, options):
+        """
+        Call a task in the way that its kind and options ask for, returning 
+        the result.
+        """
+        if options.get('memoize'):
+            return await self._memoized(obj, args, kw, options)
+        if options.get('batch'):
+            if kw:
+                raise TypeError('Batch tasks take no keyword arguments')
+            return await self._gatherer(obj, options).call(args)
+        if asyncio.iscoroutinefunction(obj):
+            return await obj(*args, **kw)
+        if inspect.isasyncgenfunction(obj):
+            # Streamed by _respond().
+            return obj(*args, **kw)
+        if options.get('process'):
+            # No thread needs to wait on the process pool.
+            return await asyncio.wrap_future(
+              self._get_process_pool().submit(obj, *args, **kw))
+        self.sync_tasks += 1
+        try:
+            return await asyncio.get_event_loop().run_in_executor(
+              self.executor, functools.partial(obj, *args, **kw))
+        finally:
+            self.sync_tasks -= 1
+    
+    async def _memoized(self, obj, args, kw, options):
+        """
+        Call a memoized task through the result cache. See 
+        `BackEnd._memoized()`.
+        """
+        key = _memo_key(obj, args, kw)
+        options = dict(options, memoize=False)
+        if key is None:
+            return await self._call(obj, args, kw, options)
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        def wake(ok, value):
+            if future.done():
+                # This waiter was cancelled.
+                return
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+        state, res = self.memo.lookup(key, wake)
+        if state == ResultCache.HIT:
+            return res
+        if state == ResultCache.WAIT:
+            return await future
+        try:
+            res = await self._call(obj, args, kw, options)
+            if inspect.isasyncgen(res):
+                res = [item async for item in res]
+            elif _is_stream(res):
+                res = await loop.run_in_executor(self.executor, list, res)
+        except BaseException as e:
+            # The waiters must be woken up even if this call is cancelled.
+            if not isinstance(e, Exception):
+                e = RuntimeError('Memoized call cancelled')
+            self.memo.finish(key, False, e)
+            raise
+        self.memo.finish(key, True, res, options.get('memo_ttl'))
+        return res
+    
+    async def _call_batch(self, obj, arg_sets, options):
+        """
+        Call a batch task. See `BackEnd._call_batch()`.
+        """
+        return _batch_results(await self._call(obj, [arg_sets], {}, options), 
+                              arg_sets)
+    
+    async def _batch_item(self, task, args, kw):
+        """
+        Run one call of a BATCH, returning its response.
+        """
+        try:
+            obj, args, options = self._lookup(task, args)
+            res = await self._call(obj, args, kw, options)
+            # No streaming inside of a batch.
+            if inspect.isasyncgen(res):
+                res = [item async for item in res]
+            elif _is_stream(res):
+                res = await asyncio.get_event_loop().run_in_executor(
+                  self.executor, list, res)
+            return ['success', res]
+        except Exception as e:
+            return self._error(task, e)
+    
+    async def _batch(self, calls):
+        """
+        The built-in BATCH task. See `BackEnd._batch()`; here the calls are 
+        run concurrently.
+        """
+        return await asyncio.gather(*[self._batch_item(task, args, kw) 
+                                      for task, args, kw in calls])
+    
+    @property
+    def queue_depth(self):
+        """
+        The number of plain tasks waiting for a free thread.
+        """
+        return max(self.sync_tasks - self.workers, 0)
+    
+    async def _send_response(self, client, res, tag=[]):
+        """
+        Encodes and sends a response, returning whether that worked. See 
+        `BackEnd._send_response()`.
+        """
+        data = self._encode_response(res, tag, client.codec)
+        try:
+            write_message(self, client.writer, data, client.version)
+            async with client.drain_lock:
+                await client.writer.drain()
+        except OSError as e:
+            self.log(ERROR, 'Could not send response: %r' % e)
+            return False
+        return True
+    
+    async def _serve(self):
+        """
+        The mainloop coroutine. See main().
+        """
+        self.stop = self.terminate = False
+        server = await asyncio.start_server(
+          self._handler, self.host, self.port, reuse_address=True, 
+          reuse_port=self.cluster is not None)
+        try:
+            # stop_server() and terminate_server() are run from other 
+            # threads (or processes, when pre-forked), so check up on them 
+            # now and then.
+            while not (self.stop or self.terminate):
+                await asyncio.sleep(END_RESP)
+                if self.cluster is not None:
+                    self.cluster.poll(self)
+            server.close()
+            while not self.terminate:
+                await asyncio.sleep(END_RESP)
+                if self.cluster is not None:
+                    self.cluster.poll(self)
+        finally:
+            server.close()
+            # Let the connection handlers wind down on their own.
+            handlers = list(self.clients)
+            for writer in self.clients.values():
+                writer.close()
+            await asyncio.gather(*handlers, return_exceptions=True)
+    
+    def main(self):
+        """
+        Runs the event loop. Blocks. Can be halted over a network, or with 
+        either stop_server() or terminate_server().
+        """
+        self.executor = ThreadPoolExecutor(self.workers)
+        try:
+            asyncio.run(self._serve())
+        except KeyboardInterrupt:
+            # We've been told to quit, do so!
+            pass
+        finally:
+            self.executor.shutdown(wait=False)
+            if self.process_pool is not None:
+                self.process_pool.shutdown(wait=False)
+
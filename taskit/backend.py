@@ -2,18 +2,59 @@
 This is the backend to the distributed version of TaskIt.
 """
 
+import os
 import sys
 import time
 import socket
+import itertools
+import multiprocessing
+from collections import OrderedDict
+try:
+    from queue import Queue, Full, Empty
+except ImportError:
+    # Python 2
+    from Queue import Queue, Full, Empty
+try:
+    from concurrent.futures import ProcessPoolExecutor
+except ImportError:
+    # Python 2 without the futures backport; no process tasks.
+    ProcessPoolExecutor = None
 
 from .threaded import *
 from .common import *
+from .common import _blob_digest
 from .log import *
+from .resync import Mediator, Channel, ChannelClosed
 
 
-__all__ = ['build_backend', 'task_stop', 'task_kill', 'task_count', 'BackEnd']
+__all__ = ['BLOCK', 'REJECT', 'SHED', 'build_backend', 'task_stop', 
+           'task_kill', 'task_count', 'task_stats', 'task_flush', 
+           'WorkerPool', 'BlobMissingError', 'BlobStore', 'ResultCache', 
+           'BackEnd']
 
 END_RESP = .5
+KEEP_ALIVE = 60
+QUEUE_SIZE = 256
+# Defaults for the 'batch_size' and 'batch_wait' task options
+BATCH_SIZE = 64
+BATCH_WAIT = .005
+# The most items of a streamed result sent in one message
+STREAM_CHUNK = 64
+# The most messages of a streamed argument held before the client must wait
+STREAM_BUFFER = 8
+# The default memory (in encoded bytes) for the blobs sent by clients
+BLOB_MEMORY = 64 * 1024 * 1024
+# The default memory (in bytes, roughly) for the results of memoized tasks
+MEMO_MEMORY = 64 * 1024 * 1024
+
+# WorkerPool() overflow policies
+BLOCK = 'block'
+REJECT = 'reject'
+SHED = 'shed'
+
+# Signals are cheap and must get through even when the backend is swamped, so 
+# they never wait in the queue.
+_SIGNALS = (STOP, KILL, STATUS, STATS, FLUSH)
 
 
 def _is_iter(obj):
@@ -23,6 +64,113 @@ def _is_iter(obj):
     return hasattr(obj, '__iter__')
 
 
+def _is_stream(obj):
+    """
+    Helper function to check whether a result is a generator or another 
+    iterator, to be streamed back item by item.
+    """
+    return hasattr(obj, '__next__') or (hasattr(obj, 'next') and 
+                                        hasattr(obj, '__iter__'))
+
+
+def _take(iterator, n):
+    """
+    Helper function to get a list of up to `n` items from `iterator`.
+    """
+    return list(itertools.islice(iterator, n))
+
+
+def _stream_id(arg):
+    """
+    Helper function to get the id from a streamed argument's placeholder, or 
+    None if `arg` isn't one.
+    """
+    if type(arg) is dict and len(arg) == 1:
+        return arg.get(STREAM)
+    return None
+
+
+def _has_blobs(args, kw):
+    """
+    Helper function to check whether any of the arguments of a call are blob 
+    placeholders.
+    """
+    for arg in args:
+        if type(arg) is dict and BLOB in arg:
+            return True
+    if kw:
+        for arg in kw.values():
+            if type(arg) is dict and BLOB in arg:
+                return True
+    return False
+
+
+def _freeze(obj):
+    """
+    Helper function to turn decoded arguments into something hashable. Types 
+    are kept, so that e.g. 1, 1.0 and True don't mix, except that lists and 
+    tuples are alike: codecs differ in which one they decode a sequence to 
+    (JSON has no tuples), and the same call must get the same key from every 
+    client.
+    """
+    kind = type(obj)
+    if kind is list or kind is tuple:
+        return list, tuple(_freeze(item) for item in obj)
+    if kind is dict:
+        return kind, frozenset((key, _freeze(value)) 
+                               for key, value in obj.items())
+    return kind, obj
+
+
+def _memo_key(obj, args, kw):
+    """
+    Helper function to get the ResultCache() key for a call, or None if its 
+    arguments can't be hashed.
+    """
+    try:
+        key = (obj, _freeze(args), _freeze(kw))
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+def _sizeof(obj):
+    """
+    Helper function to estimate the memory taken up by a result, along with 
+    the lists, tuples and dicts in it.
+    """
+    size = sys.getsizeof(obj)
+    kind = type(obj)
+    if kind is list or kind is tuple:
+        for item in obj:
+            size += _sizeof(item)
+    elif kind is dict:
+        for key, value in obj.items():
+            size += _sizeof(key) + _sizeof(value)
+    return size
+
+
+def _memo_stats(memo):
+    """
+    Helper function to get the hits, misses, results and size of the 
+    ResultCache() `memo`.
+    """
+    return [memo.hits, memo.misses, len(memo), memo.size]
+
+
+def _batch_results(results, arg_sets):
+    """
+    Helper function to check that a batch task returned a result for each 
+    call.
+    """
+    results = list(results)
+    if len(results) != len(arg_sets):
+        raise ValueError('Batch task returned %s results for %s calls' % 
+                         (len(results), len(arg_sets)))
+    return results
+
+
 def build_backend(tasks, default_host=('127.0.0.1', DEFAULT_PORT), *args, 
                   **kw):
     """
@@ -70,11 +218,476 @@ def task_count(backend):
     A task to allow getting the backend's task count. Should be supported.
     """
     # Yes, a string, because that is what the client expects
-    return str(backend.task_count)
+    return str(backend.total_tasks())
+
+
+def task_stats(backend):
+    """
+    A task to allow getting a dict of the backend's statistics, such as its 
+    task count and queue depth. See `BackEnd.stats()`.
+    """
+    return backend.stats()
+
+
+def task_flush(backend):
+    """
+    A task to empty the backend's cache of the results of memoized tasks, 
+    e.g. after the data that they depend on has changed. Under 
+    main_prefork(), the caches of the other processes are emptied as well, 
+    within END_RESP seconds.
+    """
+    if backend.cluster is not None:
+        backend.cluster.flush()
+    backend.memo.clear()
 
 
 ADMIN_TASKS = {STOP: (task_stop, True), KILL: (task_kill, True), 
-               STATUS: (task_count, True)}
+               STATUS: (task_count, True), STATS: (task_stats, True), 
+               FLUSH: (task_flush, True)}
+
+
+class WorkerPool(object):
+    
+    """
+    A fixed number of worker threads fed from a bounded queue of jobs. What 
+    happens when the queue is full is decided by the overflow policy:
+      BLOCK  -- Wait for room in the queue.
+      REJECT -- Reject the new job.
+      SHED   -- Reject the oldest queued job to make room for the new one.
+    """
+    
+    def __init__(self, workers, queue_size=QUEUE_SIZE, overflow=BLOCK):
+        """
+        workers    -- The number of worker threads. 
+        queue_size -- The number of jobs that may wait for a free worker. 
+        overflow   -- The overflow policy, one of BLOCK, REJECT, or SHED.
+        """
+        if overflow not in (BLOCK, REJECT, SHED):
+            raise ValueError('Unknown overflow policy %r!' % overflow)
+        self.workers = workers
+        self.overflow = overflow
+        self.queue = Queue(queue_size)
+        self.shed_mutex = allocate_lock()
+        self.started = False
+    
+    def __len__(self):
+        """
+        The number of jobs waiting for a free worker.
+        """
+        return self.queue.qsize()
+    
+    def _worker(self):
+        while 1:
+            func, args, reject = self.queue.get()
+            try:
+                func(*args)
+            except Exception:
+                show_err()
+    
+    def start(self):
+        """
+        Start the worker threads. Done separately from initialization so that 
+        no threads are started before a fork.
+        """
+        if not self.started:
+            self.started = True
+            for i in range(self.workers):
+                threaded(self._worker, ())
+    
+    def submit(self, func, args, reject):
+        """
+        Queue up `func(*args)`. Should the job be rejected or shed, `reject()` 
+        is called instead.
+        """
+        job = (func, args, reject)
+        if self.overflow == BLOCK:
+            self.queue.put(job)
+            return
+        try:
+            self.queue.put_nowait(job)
+            return
+        except Full:
+            if self.overflow == REJECT:
+                reject()
+                return
+        
+        shed = []
+        with self.shed_mutex:
+            while 1:
+                try:
+                    self.queue.put_nowait(job)
+                    break
+                except Full:
+                    try:
+                        shed.append(self.queue.get_nowait())
+                    except Empty:
+                        pass
+        for func, args, reject in shed:
+            reject()
+
+
+class _Gatherer(object):
+    
+    """
+    Gathers up concurrent calls to a batch task, and makes them as a single 
+    call with a list of their arguments. The first call waits up to 
+    'batch_wait' seconds for others to join it, and then makes the batch call 
+    on its own handler thread, unless a call that fills the batch up to 
+    'batch_size' has already made it on its own. The other calls wait for 
+    their results meanwhile.
+    """
+    
+    def __init__(self, backend, obj, options):
+        self.backend = backend
+        self.obj = obj
+        self.size = options.get('batch_size', BATCH_SIZE)
+        self.wait = options.get('batch_wait', BATCH_WAIT)
+        # What the batch call itself is made with
+        self.options = dict(options, batch=False)
+        self.arg_sets = []
+        self.mediators = []
+        self.generation = 0
+        self.mutex = allocate_lock()
+    
+    def _take(self):
+        """
+        Take the waiting calls. Must be called with the mutex held.
+        """
+        batch = self.arg_sets, self.mediators
+        self.arg_sets, self.mediators = [], []
+        self.generation += 1
+        return batch
+    
+    def _run(self, arg_sets, mediators):
+        try:
+            results = self.backend._call_batch(self.obj, arg_sets, 
+                                               self.options)
+        except Exception as e:
+            for mediator in mediators:
+                mediator.set_error(e)
+        else:
+            for mediator, res in zip(mediators, results):
+                mediator.set_result(res)
+    
+    def call(self, args):
+        """
+        Add a call to the batch, and wait for its result.
+        """
+        mediator = Mediator()
+        batch = None
+        with self.mutex:
+            self.arg_sets.append(args)
+            self.mediators.append(mediator)
+            generation = self.generation
+            first = len(self.arg_sets) == 1
+            if len(self.arg_sets) >= self.size:
+                batch = self._take()
+        if batch is None and first:
+            time.sleep(self.wait)
+            with self.mutex:
+                if generation == self.generation:
+                    batch = self._take()
+        if batch is not None:
+            self._run(*batch)
+        return mediator.get()
+
+
+class _Cluster(object):
+    
+    """
+    The state shared between the processes of a pre-forked BackEnd: a task 
+    count and result cache statistics for each process, a control value that 
+    tells them all to stop or terminate, and a count of FLUSHes, which tells 
+    them to empty their result caches.
+    """
+    
+    RUN, STOP, KILL = range(3)
+    # The number of result cache statistics kept for each process
+    MEMO_STATS = 4
+    
+    def __init__(self, forks):
+        self.counts = multiprocessing.Array('l', forks)
+        self.memo_stats = multiprocessing.Array('l', forks * self.MEMO_STATS)
+        self.control = multiprocessing.Value('i', self.RUN)
+        self.flushes = multiprocessing.Value('l', 0)
+        # Which count belongs to this process; set after forking.
+        self.slot = None
+        # The FLUSHes that this process has applied
+        self.flushed = 0
+    
+    def poll(self, backend):
+        """
+        Apply a STOP, KILL or FLUSH sent to any of the processes to 
+        `backend`, and share its result cache statistics.
+        """
+        control = self.control.value
+        if control == self.KILL:
+            backend.terminate = True
+        elif control == self.STOP and not backend.stop:
+            backend.stop = True
+            threaded(backend.stop_server, ())
+        flushes = self.flushes.value
+        if flushes != self.flushed:
+            self.flushed = flushes
+            backend.memo.clear()
+        self.share_memo_stats(backend)
+    
+    def flush(self):
+        """
+        Tell every process to empty its result cache.
+        """
+        with self.flushes.get_lock():
+            self.flushes.value += 1
+    
+    def share_memo_stats(self, backend):
+        """
+        Publish the result cache statistics of `backend`, the backend of this 
+        process.
+        """
+        start = self.slot * self.MEMO_STATS
+        self.memo_stats[start:start + self.MEMO_STATS] = _memo_stats(
+          backend.memo)
+    
+    def memo_totals(self):
+        """
+        Get the result cache statistics summed over all of the processes.
+        """
+        stats = self.memo_stats[:]
+        return [sum(stats[i::self.MEMO_STATS]) 
+                for i in range(self.MEMO_STATS)]
+    
+    def forget(self, slot):
+        """
+        Clear the counts of a process that has died.
+        """
+        self.counts[slot] = 0
+        start = slot * self.MEMO_STATS
+        self.memo_stats[start:start + self.MEMO_STATS] = [0] * self.MEMO_STATS
+
+
+class _ArgStream(object):
+    
+    """
+    The iterator that a task gets for a streamed argument, fed with the 
+    chunks that arrive after its request.
+    """
+    
+    def __init__(self):
+        self.chunks = Channel(STREAM_BUFFER)
+        self.items = iter(())
+    
+    def __iter__(self):
+        return self
+    
+    def __next__(self):
+        while 1:
+            for item in self.items:
+                return item
+            try:
+                self.items = iter(self.chunks.get())
+            except ChannelClosed:
+                raise StopIteration
+    
+    # Python 2
+    next = __next__
+    
+    def feed(self, items):
+        """
+        Add a chunk of items, waiting while the buffer is full. Items arriving 
+        after the task is done with the stream are dropped.
+        """
+        try:
+            self.chunks.put(items)
+        except ChannelClosed:
+            pass
+    
+    def close(self, error=None):
+        """
+        End the stream, with `error` raised to the task once it has gotten 
+        everything before it, if given.
+        """
+        self.chunks.close(error)
+
+
+class BlobMissingError(KeyError):
+    """
+    Raised for requests referring to blobs that the backend doesn't hold (or 
+    no longer holds), with their digests as the arguments. The client then 
+    sends them along.
+    """
+
+
+class BlobStore(object):
+    
+    """
+    Holds the large arguments that clients have sent along with a request, 
+    by the digest of their contents, so that later requests may refer to 
+    them by digest instead of sending them again (see `Blob()` in 
+    taskit.frontend). When the blobs take up more than `memory` bytes, 
+    counted by their encoded sizes, the least recently used ones are 
+    dropped. 
+    
+    Tasks get the very same objects each time, so they must not modify them.
+    """
+    
+    def __init__(self, memory=BLOB_MEMORY):
+        self.memory = memory
+        self.size = 0
+        self.blobs = OrderedDict()
+        self.mutex = allocate_lock()
+    
+    def __len__(self):
+        return len(self.blobs)
+    
+    def get(self, digest):
+        """
+        Get the blob with `digest`, raising a KeyError if it isn't held.
+        """
+        with self.mutex:
+            # Move it to the most recently used end.
+            item = self.blobs[digest] = self.blobs.pop(digest)
+        return item[0]
+    
+    def put(self, digest, value, size):
+        """
+        Hold `value`, `size` bytes long when encoded, under `digest`, dropping 
+        the least recently used blobs as needed to make room for it. Blobs 
+        larger than the whole store are not held at all.
+        """
+        if size > self.memory:
+            return
+        with self.mutex:
+            self._hold(digest, (value, size))
+    
+    def _hold(self, key, item):
+        """
+        Hold `item`, a (value, size, ...) tuple, under `key`, dropping the 
+        least recently used items as needed. Must be called with the mutex 
+        held.
+        """
+        old = self.blobs.pop(key, None)
+        if old is not None:
+            self.size -= old[1]
+        self.blobs[key] = item
+        self.size += item[1]
+        while self.size > self.memory:
+            self.size -= self.blobs.popitem(last=False)[1][1]
+    
+    def clear(self):
+        """
+        Drop all of the blobs.
+        """
+        with self.mutex:
+            self.blobs.clear()
+            self.size = 0
+
+
+class ResultCache(BlobStore):
+    
+    """
+    Holds the results of memoized tasks (see the 'memoize' task option) by 
+    the callable and its arguments, dropping the least recently used ones to 
+    stay within `memory` bytes, as roughly estimated, and those older than 
+    their time to live. 
+    
+    It also keeps track of the calls that are running, so that identical 
+    calls made meanwhile wait for the first one to finish, rather than 
+    running again. Only successful results are held, but the calls that 
+    waited get errors as well.
+    """
+    
+    HIT, WAIT, RUN = range(3)
+    
+    def __init__(self, memory=MEMO_MEMORY):
+        BlobStore.__init__(self, memory)
+        # The generation that each running call started in, and its waiters
+        self.running = {}
+        self.hits = 0
+        self.misses = 0
+        # Bumped by clear(), so that calls started before it aren't held.
+        self.generation = 0
+    
+    def lookup(self, key, waiter):
+        """
+        Look up the call `key`, returning a (state, result) pair. The state 
+        is one of: 
+          HIT  -- The result is held, and is returned. 
+          WAIT -- The same call is running; `waiter(ok, value)` will be 
+                  called with its result (or error, if not `ok`). 
+          RUN  -- The caller must make the call, and then finish() it. 
+        """
+        with self.mutex:
+            item = self.blobs.pop(key, None)
+            if item is not None:
+                if item[2] is None or item[2] > time.time():
+                    self.blobs[key] = item
+                    self.hits += 1
+                    return self.HIT, item[0]
+                # Expired
+                self.size -= item[1]
+            running = self.running.get(key)
+            if running is not None:
+                running[1].append(waiter)
+                self.hits += 1
+                return self.WAIT, None
+            self.running[key] = self.generation, []
+            self.misses += 1
+            return self.RUN, None
+    
+    def finish(self, key, ok, value, ttl=None):
+        """
+        Finish the call `key`, which was looked up to RUN, with its result 
+        (or error, if not `ok`), which is held for `ttl` seconds, or until it 
+        is dropped to make room if None. Its waiters are given it as well. 
+        Results of calls that started before the last clear() aren't held.
+        """
+        size = _sizeof(value) if ok else 0
+        expires = None if ttl is None else time.time() + ttl
+        with self.mutex:
+            generation, waiters = self.running.pop(key)
+            if ok and generation == self.generation and size <= self.memory:
+                self._hold(key, (value, size, expires))
+        for waiter in waiters:
+            waiter(ok, value)
+    
+    def clear(self):
+        """
+        Drop all of the results.
+        """
+        with self.mutex:
+            self.generation += 1
+        BlobStore.clear(self)
+
+
+class _Client(object):
+    
+    """
+    Per-connection state kept by the BackEnd's connection handlers.
+    """
+    
+    def __init__(self, sock):
+        self.sock = sock
+        # Responses to multiplexed requests may be sent from several threads 
+        # at once.
+        self.send_mutex = allocate_lock()
+        # Responses use the FirstBytes version of the last request.
+        self.version = 1
+        # The codec used on this connection, picked on its first request
+        self.codec = None
+        # The codec that the client works out Blob() digests with: the one it 
+        # started out in, before any HELLO
+        self.blob_codec = None
+        # The number of requests from this connection yet to be answered
+        self.pending = 0
+        self.pending_mutex = allocate_lock()
+    
+    def started(self):
+        with self.pending_mutex:
+            self.pending += 1
+    
+    def finished(self):
+        with self.pending_mutex:
+            self.pending -= 1
 
 
 class BackEnd(FirstBytesProtocol):
@@ -83,15 +696,64 @@ class BackEnd(FirstBytesProtocol):
     The TaskIt DTPM server. Starts, tracks, and handles tasks.
     """
     
+    # What gathers up the calls to batch tasks
+    _gatherer_type = _Gatherer
+    
     def __init__(self, tasks, host='127.0.0.1', port=DEFAULT_PORT, 
                  logger=null_logger, codec=JSONCodec, end_resp=END_RESP, 
-                 tracebacks=True):
+                 tracebacks=True, keep_alive=KEEP_ALIVE, workers=None, 
+                 queue_size=QUEUE_SIZE, overflow=BLOCK, processes=None, 
+                 codecs=(), blob_memory=BLOB_MEMORY, memo_memory=MEMO_MEMORY):
         """
-        tasks      -- a dict consisting of task:callable or 
-                      task:(callable, bool) items. The boolean, which defaults 
-                      to False, determines whether or not the BackEnd() 
-                      instance will be passed as the first argument to the 
-                      callable. Useful for tasks needing backend.subtask(). 
+        tasks      -- a dict consisting of task:callable, 
+                      task:(callable, bool), or task:(callable, bool, options) 
+                      items. The boolean, which defaults to False, determines 
+                      whether or not the BackEnd() instance will be passed as 
+                      the first argument to the callable. Useful for tasks 
+                      needing backend.subtask(). `options` is a dict that may 
+                      hold the following: 
+                        'process' -- If True, the task is run in a process 
+                                     pool, which lets CPU-bound tasks use 
+                                     more than one core. The callable, its 
+                                     arguments and its result must be 
+                                     picklable, and the backend cannot be 
+                                     passed to it. 
+                        'batch'   -- If True, concurrent calls to the task 
+                                     are gathered up, and the callable is 
+                                     called once with a list of their 
+                                     argument lists, returning a list of 
+                                     their results. Good for vectorized 
+                                     (e.g. NumPy) code. Calls may not use 
+                                     keyword arguments, and an error fails 
+                                     every call in the batch. The backend 
+                                     cannot be passed to the task. 
+                        'batch_size' -- The most calls in one batch 
+                                     (default 64). 
+                        'batch_wait' -- The longest time (in seconds) that a 
+                                     call waits for others to join it 
+                                     (default .005). 
+                        'stream_chunk' -- The most items of a streamed result 
+                                     sent in one message (default 64). 
+                                     Each message waits until it is full, 
+                                     so use 1 for tasks that produce items 
+                                     slowly. 
+                        'memoize' -- If True, the results of the task are 
+                                     held in a ResultCache(), and calls with 
+                                     the same arguments are answered from 
+                                     it; identical calls made while one is 
+                                     running wait for its result. Only for 
+                                     tasks whose results depend on nothing 
+                                     but their arguments. Generators are run 
+                                     to the end, and their items sent all 
+                                     at once. The FLUSH signal empties the 
+                                     cache. 
+                        'memo_ttl' -- The time (in seconds) for which the 
+                                     results of a memoized task are good 
+                                     (default: until they are dropped to 
+                                     make room). 
+                      A task that returns a generator (or any other iterator) 
+                      has its items streamed back as they are produced; see 
+                      FrontEnd.stream(). 
         host       -- The host to bind to. 
         port       -- The port to bind to. 
         logger     -- A logger supporting the taskit.log interface. 
@@ -101,6 +763,31 @@ class BackEnd(FirstBytesProtocol):
                       for socket timeouts and while x:sleep() wait loops.
         tracebacks -- Whether or not the server should output task tracebacks 
                       (in the same way that they would be if not caught).
+        keep_alive -- The time (in seconds) that an idle client connection is 
+                      kept open waiting for another request. None keeps idle 
+                      connections open indefinitely. 
+        workers    -- The number of worker threads that run tasks. If None, 
+                      every multiplexed request gets a thread of its own, and 
+                      other requests are run by their connection's thread. 
+        queue_size -- The number of tasks that may wait for a free worker. 
+        overflow   -- What to do with a task when the queue is full: BLOCK 
+                      (stop reading requests until there is room), REJECT 
+                      (answer with a BackendBusyError, so that the client may 
+                      try another backend), or SHED (make room by rejecting 
+                      the task that has waited longest). 
+        processes  -- The number of processes in the pool used for 'process' 
+                      tasks. Defaults to the number of CPUs. 
+        codecs     -- Other codecs that clients may pick in a HELLO handshake 
+                      (see `FrontEnd()`), e.g. [BinaryCodec]. Clients that 
+                      don't shake hands are spoken to with `codec`. Codecs 
+                      whose messages are bytes (those with a true `binary` 
+                      attribute) are only agreed on with clients that speak 
+                      FirstBytes version 2.
+        blob_memory -- The memory (in bytes, as encoded) for the Blob() 
+                      arguments that clients refer to by digest; see 
+                      `BlobStore()`. 
+        memo_memory -- The memory (in bytes, roughly) for the results of 
+                      memoized tasks; see `ResultCache()`. 
         """
         FirstBytesProtocol.__init__(self, logger)
         
@@ -108,7 +795,22 @@ class BackEnd(FirstBytesProtocol):
         self.host = host
         self.port = port
         self.codec = codec
+        # The codecs that clients may pick, by name
+        self.codecs = dict((c.name, c) for c in [codec] + list(codecs) 
+                           if getattr(c, 'name', None) is not None)
         self.tracebacks = tracebacks
+        self.keep_alive = keep_alive
+        self.processes = processes
+        self.process_pool = None
+        self.cluster = None
+        self.process_mutex = allocate_lock()
+        self.gatherers = {}
+        self.gather_mutex = allocate_lock()
+        self.blobs = BlobStore(blob_memory)
+        self.memo = ResultCache(memo_memory)
+        self.pool = None
+        if workers:
+            self.pool = WorkerPool(workers, queue_size, overflow)
         self.task_count = 0
         # Is this necessary to avoid problems with the task counter getting 
         # corrupted? That is, are self.task_count += 1 and self.task_count -= 1 
@@ -124,41 +826,495 @@ class BackEnd(FirstBytesProtocol):
     
     def _handler(self, conn):
         """
-        Connection handler thread. Takes care of communication with the client 
-        and running the proper task or applying a signal.
+        Connection handler thread. Serves requests from the client until the 
+        client closes the connection or leaves it idle for longer than 
+        `keep_alive`. Plain requests are answered one after the other, while 
+        multiplexed ones (those carrying a request id) are started as they 
+        arrive and answered as they finish.
         """
-        incoming = self.recv(conn)
-        self.log(DEBUG, incoming)
+        conn.settimeout(self.keep_alive)
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        client = _Client(conn)
         try:
-            # E.g. ['twister', [7, 'invert'], {'guess_type': True}]
-            task, args, kw = self.codec.decode(incoming)
+            while 1:
+                if not self._wait_request(client):
+                    break
+                try:
+                    client.version, incoming = self.recv_message(conn)
+                except (socket.error, FirstBytesCorruptionError):
+                    # Closed, timed out, or broken; either way, we are done.
+                    break
+                self.log(DEBUG, incoming)
+                if client.codec is None:
+                    client.codec = client.blob_codec = self._pick_codec(
+                      incoming)
+                try:
+                    request = client.codec.decode(incoming)
+                    multiplexed = len(request) > 3
+                except Exception as e:
+                    self.log(ERROR, 'Could not decode request: %r' % e)
+                    break
+                
+                if request[0] == HELLO:
+                    self._hello(client, request)
+                    continue
+                if self.stop and request[0] not in _SIGNALS:
+                    self._stopping(client, request)
+                    if request[0] == STREAM:
+                        # Its streamed arguments would follow it.
+                        break
+                    continue
+                client.started()
+                self.started_task()
+                if request[0] == STREAM:
+                    if not self._respond_streamed(client, request):
+                        break
+                else:
+                    self._dispatch(client, request, multiplexed)
+        finally:
+            conn.close()
+    
+    def _wait_request(self, client):
+        """
+        Wait for the next request from `client`, returning False once its 
+        connection has been idle for `keep_alive`. It is only idle while none 
+        of its requests are running, as their responses are still to come, 
+        however long that takes. Peeks under the socket's timeout, as select() 
+        can't take descriptors past FD_SETSIZE.
+        """
+        while 1:
+            try:
+                # Nothing, if closed
+                return bool(client.sock.recv(1, socket.MSG_PEEK))
+            except socket.timeout:
+                if not client.pending:
+                    return False
+            except socket.error:
+                # Broken
+                return False
+    
+    def _dispatch(self, client, request, multiplexed):
+        """
+        Run a request right away, in a new thread, or through the worker pool, 
+        as appropriate.
+        """
+        if self.pool is None or request[0] in _SIGNALS:
+            if multiplexed:
+                threaded(self._respond, (client, request))
+            else:
+                self._respond(client, request)
+        else:
+            self.pool.submit(self._respond, (client, request), 
+                             lambda: self._reject(client, request))
+    
+    def _open_streams(self, request, stream_type=_ArgStream):
+        """
+        Unwrap a STREAM request, returning the inner request with the 
+        placeholders in its args and kw replaced by `stream_type()`s, and 
+        those by id.
+        """
+        task, args, kw = request[1]
+        streams = {}
+        args = list(args)
+        for i, arg in enumerate(args):
+            sid = _stream_id(arg)
+            if sid is not None:
+                args[i] = streams[sid] = stream_type()
+        for key, arg in kw.items():
+            sid = _stream_id(arg)
+            if sid is not None:
+                kw[key] = streams[sid] = stream_type()
+        return [task, args, kw], streams
+    
+    def _respond_streamed(self, client, request):
+        """
+        Answer a STREAM request, [STREAM, [task, args, kw], {}], whose 
+        streamed arguments follow it as [id, items] messages, each ending with 
+        [id, None]. The task runs on a thread of its own, outside of the 
+        worker pool, while this one feeds it those messages. Returns whether 
+        the connection is still usable.
+        """
+        request, streams = self._open_streams(request)
+        finished = Mediator()
+        def respond():
+            try:
+                self._respond(client, request)
+            finally:
+                # Anything else that arrives goes nowhere.
+                for stream in streams.values():
+                    stream.close()
+                finished.set_result(None)
+        threaded(respond, ())
+        
+        remaining = set(streams)
+        try:
+            while remaining:
+                client.version, incoming = self.recv_message(client.sock)
+                sid, items = client.codec.decode(incoming)
+                if sid not in remaining:
+                    raise FirstBytesCorruptionError(
+                      'Data for an unknown stream %r' % sid)
+                if items is None:
+                    remaining.discard(sid)
+                    streams[sid].close()
+                else:
+                    streams[sid].feed(items)
+        except Exception as e:
+            self.log(ERROR, 'Streamed arguments broken off: %r' % e)
+            for stream in streams.values():
+                stream.close(e)
+            finished.get()
+            return False
+        finished.get()
+        return True
+    
+    def _stopping(self, client, request):
+        """
+        Turn away a request that arrived after the backend was told to stop, 
+        so that the client may take it to another backend.
+        """
+        self._send_response(client, 
+                            ['error', BUSY, ['The backend is stopping']], 
+                            request[3:])
+    
+    def _reject(self, client, request):
+        """
+        Answer a request that was turned away by the worker pool.
+        """
+        self.log(ERROR, 'Too busy for task %r' % request[0])
+        self._send_response(client, 
+                            ['error', BUSY, ['The backend is too busy']], 
+                            request[3:])
+        client.finished()
+        self.finished_task()
+    
+    def _respond(self, client, request):
+        """
+        Takes care of running the proper task or applying a signal for one 
+        request, and of sending the response back to the client.
+        """
+        task = None
+        try:
+            # E.g. ['twister', [7, 'invert'], {'guess_type': True}], with the 
+            # request id appended for multiplexed requests.
+            task, args, kw = request[:3]
+            if _has_blobs(args, kw):
+                args, kw = self._unpack_blobs(args, kw, client.blob_codec)
             
             # OK, so we've received the information. Now to use it.
             self.log(INFO, 'Fulfilling task %r' % task)
-            self.started_task()
-            
-            pass_backend = False
-            obj = self.tasks[task]
-            if _is_iter(obj):
-                # (callable, bool)
-                obj, pass_backend = obj
-            if pass_backend:
-                # Have to do this, since args is a list
-                args = [self] + args
+            obj, args, options = self._lookup(task, args)
             
             # Get and package the result
-            res = ['success', obj(*args, **kw)]
+            res = ['success', self._call(obj, args, kw, options)]
+            if _is_stream(res[1]):
+                res = self._stream(client, task, res[1], options, 
+                                   request[3:])
+        except BlobMissingError as e:
+            # Nothing wrong; the client sends them along and asks again.
+            res = ['error', MISSING_BLOB, list(e.args)]
         except Exception as e:
-            self.log(ERROR, 'Error while fullfilling task %r: %r' % (task, e))
-            res = ['error', e.__class__.__name__, e.args]
-            if self.tracebacks:
-                show_err()
+            res = self._error(task, e)
         else:
             self.log(INFO, 'Finished fulfilling task %r' % task)
         finally:
-            self.send(conn, self.codec.encode(res))
+            self._send_response(client, res, request[3:])
+            client.finished()
             self.finished_task()
-            conn.close()
+    
+    def _stream(self, client, task, iterator, options, tag):
+        """
+        Send the items of `iterator` as ['yield', items] messages as they are 
+        produced, returning the final response. The first item goes out on 
+        its own, so that the client gets it as soon as possible, and each 
+        message after that holds up to twice as many, up to the task's 
+        'stream_chunk' option.
+        """
+        limit = options.get('stream_chunk', STREAM_CHUNK)
+        size = 1
+        while 1:
+            try:
+                items = _take(iterator, size)
+            except Exception as e:
+                return self._error(task, e)
+            if not items:
+                return ['success', None]
+            if not self._send_response(client, ['yield', items], tag):
+                # Nobody is listening any more.
+                close = getattr(iterator, 'close', None)
+                if close is not None:
+                    close()
+                return ['success', None]
+            size = min(size * 2, limit)
+    
+    def _lookup(self, task, args):
+        """
+        Find the callable for `task` in the task table, returning it along 
+        with the arguments that it should be called with and its options.
+        """
+        if task == BATCH:
+            return self._batch, args, {}
+        pass_backend = False
+        options = {}
+        obj = self.tasks[task]
+        if _is_iter(obj):
+            if len(obj) > 2:
+                # (callable, bool, options)
+                options = obj[2]
+            # (callable, bool)
+            obj, pass_backend = obj[:2]
+        if pass_backend:
+            if options.get('process'):
+                raise ValueError('The backend cannot be passed to a task '
+                                 'run in another process')
+            if options.get('batch'):
+                raise ValueError('The backend cannot be passed to a batch '
+                                 'task')
+            # Have to do this, since args is a list (or, with some codecs, a 
+            # tuple)
+            args = [self] + list(args)
+        return obj, args, options
+    
+    def _unpack_blobs(self, args, kw, codec):
+        """
+        Replace the blob placeholders in `args` and `kw` with the blobs, 
+        holding on to those sent along, and raising a BlobMissingError for 
+        those that aren't held. The digest and size of a blob sent along are 
+        worked out again with `codec`, as the client did, rather than taken 
+        on trust, so that no client can go past the memory limit, or hold a 
+        value under the digest of another.
+        """
+        missing = []
+        args = [self._unpack_blob(arg, missing, codec) for arg in args]
+        kw = dict((key, self._unpack_blob(arg, missing, codec)) 
+                  for key, arg in kw.items())
+        if missing:
+            raise BlobMissingError(*missing)
+        return args, kw
+    
+    def _unpack_blob(self, arg, missing, codec):
+        """
+        Used internally to unpack one argument for _unpack_blobs().
+        """
+        if type(arg) is not dict or len(arg) != 1 or BLOB not in arg:
+            return arg
+        ref = arg[BLOB]
+        if isinstance(ref, basestring):
+            try:
+                return self.blobs.get(ref)
+            except KeyError:
+                missing.append(ref)
+                return None
+        value = ref[2]
+        digest, size = _blob_digest(value, codec)
+        if digest == ref[0]:
+            self.blobs.put(digest, value, size)
+        else:
+            # Not what it claims to be (or not encoded the same way again); 
+            # fine for this call, but not for others.
+            self.log(ERROR, 'Blob %s does not match its digest' % ref[0])
+        return value
+    
+    def _batch(self, calls):
+        """
+        The built-in BATCH task. Runs each [task, args, kw] call in `calls` 
+        in turn, and returns a list of their responses, each just like the 
+        response to a single request. One call failing doesn't stop the rest. 
+        Calls to batch tasks are made together, without waiting for others.
+        """
+        results = [None] * len(calls)
+        vectors = {}
+        for i, (task, args, kw) in enumerate(calls):
+            try:
+                obj, args, options = self._lookup(task, args)
+                if options.get('batch') and not kw:
+                    vector = vectors.setdefault(obj, (task, options, [], []))
+                    vector[2].append(i)
+                    vector[3].append(args)
+                    continue
+                res = self._call(obj, args, kw, options)
+                if _is_stream(res):
+                    # No streaming inside of a batch.
+                    res = list(res)
+                results[i] = ['success', res]
+            except Exception as e:
+                results[i] = self._error(task, e)
+        
+        for obj, (task, options, indexes, arg_sets) in vectors.items():
+            size = options.get('batch_size', BATCH_SIZE)
+            options = dict(options, batch=False)
+            for start in range(0, len(indexes), size):
+                end = start + size
+                try:
+                    res = [['success', r] for r in 
+                           self._call_batch(obj, arg_sets[start:end], options)]
+                except Exception as e:
+                    res = [self._error(task, e)] * len(indexes[start:end])
+                for i, r in zip(indexes[start:end], res):
+                    results[i] = r
+        return results
+    
+    def _gatherer(self, obj, options):
+        """
+        Get the gatherer for the batch task `obj`, creating it if need be.
+        """
+        gatherer = self.gatherers.get(obj)
+        if gatherer is None:
+            with self.gather_mutex:
+                gatherer = self.gatherers.get(obj)
+                if gatherer is None:
+                    gatherer = self.gatherers[obj] = self._gatherer_type(
+                      self, obj, options)
+        return gatherer
+    
+    def _call_batch(self, obj, arg_sets, options):
+        """
+        Call the batch task `obj` with a list of argument lists, returning the 
+        list of results. `options` must not ask for a batch.
+        """
+        return _batch_results(self._call(obj, [arg_sets], {}, options), 
+                              arg_sets)
+    
+    def _get_process_pool(self):
+        """
+        Get the process pool, starting it if need be. It is not started 
+        earlier, so that no pool is started when none is needed, and so that 
+        none is inherited through a fork.
+        """
+        if self.process_pool is None:
+            if ProcessPoolExecutor is None:
+                raise RuntimeError('Process tasks require concurrent.futures')
+            with self.process_mutex:
+                if self.process_pool is None:
+                    self.process_pool = ProcessPoolExecutor(self.processes)
+        return self.process_pool
+    
+    def _call(self, obj, args, kw, options):
+        """
+        Call a task in the way that its options ask for, returning the result.
+        """
+        if options.get('memoize'):
+            return self._memoized(obj, args, kw, options)
+        if options.get('batch'):
+            if kw:
+                raise TypeError('Batch tasks take no keyword arguments')
+            return self._gatherer(obj, options).call(args)
+        if options.get('process'):
+            # Arguments and results are pickled across, which is about as 
+            # quick as it gets; this thread just waits for the result.
+            return self._get_process_pool().submit(obj, *args, **kw).result()
+        return obj(*args, **kw)
+    
+    def _memoized(self, obj, args, kw, options):
+        """
+        Call a memoized task through the result cache.
+        """
+        key = _memo_key(obj, args, kw)
+        options = dict(options, memoize=False)
+        if key is None:
+            # Nothing to look it up by.
+            return self._call(obj, args, kw, options)
+        mediator = Mediator()
+        def wake(ok, value):
+            if ok:
+                mediator.set_result(value)
+            else:
+                mediator.set_error(value)
+        state, res = self.memo.lookup(key, wake)
+        if state == ResultCache.HIT:
+            return res
+        if state == ResultCache.WAIT:
+            return mediator.get()
+        try:
+            res = self._call(obj, args, kw, options)
+            if _is_stream(res):
+                res = list(res)
+        except BaseException as e:
+            # The waiters must be woken up whatever happens, but only get 
+            # real errors.
+            if not isinstance(e, Exception):
+                e = RuntimeError('Memoized call interrupted: %r' % e)
+            self.memo.finish(key, False, e)
+            raise
+        self.memo.finish(key, True, res, options.get('memo_ttl'))
+        return res
+    
+    def _error(self, task, e):
+        """
+        Log the error `e` raised by `task` and package it up for the client. 
+        Must be called from the `except` clause.
+        """
+        self.log(ERROR, 'Error while fullfilling task %r: %r' % (task, e))
+        if self.tracebacks:
+            show_err()
+        return ['error', e.__class__.__name__, e.args]
+    
+    def _hello(self, client, request):
+        """
+        Answer a HELLO handshake, [HELLO, [codec names, versions], {}], with 
+        the first of the client's codecs that this backend knows (or None, to 
+        keep to the one in use) and the newest FirstBytes version that both 
+        ends speak. The rest of the connection is then in that codec.
+        """
+        name, version = self._agree(request)
+        self._send_response(client, ['success', [name, version]])
+        if name is not None:
+            client.codec = self.codecs[name]
+    
+    def _agree(self, request):
+        """
+        Pick the codec name and FirstBytes version to answer a HELLO with. 
+        Codecs whose messages are bytes are only picked for version 2.
+        """
+        names, versions = request[1]
+        version = max([v for v in versions if v in (1, 2)] or [1])
+        for name in names:
+            codec = self.codecs.get(name)
+            if codec is not None and (version == 2 or 
+                                      not getattr(codec, 'binary', False)):
+                break
+        else:
+            name = None
+        return name, version
+    
+    def _pick_codec(self, data):
+        """
+        Pick the codec for a connection, given its first message. A codec may 
+        choose for itself through a for_message() method; e.g. 
+        CompressedCodec() answers clients that don't compress in kind.
+        """
+        pick = getattr(self.codec, 'for_message', None)
+        return self.codec if pick is None else pick(data)
+    
+    def _encode_response(self, res, tag=[], codec=None):
+        """
+        Encodes a response with `codec` (by default, the backend's), 
+        appending `tag` (the request id, for multiplexed requests). A result 
+        that cannot be encoded is replaced with an error, so that the client 
+        is not left waiting.
+        """
+        codec = codec or self.codec
+        try:
+            return codec.encode(res + tag)
+        except Exception as e:
+            self.log(ERROR, 'Could not encode response %r: %r' % (res, e))
+            return codec.encode(['error', e.__class__.__name__, 
+                                 [repr(a) for a in e.args]] + tag)
+    
+    def _send_response(self, client, res, tag=[]):
+        """
+        Encodes and sends a response, returning whether that worked. A client 
+        that has gone away is only logged, as its connection handler will 
+        notice as well.
+        """
+        data = self._encode_response(res, tag, client.codec)
+        try:
+            with client.send_mutex:
+                self.send(client.sock, data, client.version)
+        except socket.error as e:
+            self.log(ERROR, 'Could not send response: %r' % e)
+            return False
+        return True
     
     def subtask(self, func, *args, **kw):
         """
@@ -177,6 +1333,28 @@ class BackEnd(FirstBytesProtocol):
         finally:
             self.finished_task()
     
+    @property
+    def queue_depth(self):
+        """
+        The number of tasks waiting for a free worker.
+        """
+        return len(self.pool) if self.pool is not None else 0
+    
+    def stats(self):
+        """
+        Get a dict of statistics about this backend, as sent in response to 
+        the STATS signal.
+        """
+        if self.cluster is None:
+            memo = _memo_stats(self.memo)
+        else:
+            self.cluster.share_memo_stats(self)
+            memo = self.cluster.memo_totals()
+        return {'tasks': self.total_tasks(), 'queued': self.queue_depth, 
+                'blobs': len(self.blobs), 'blob_bytes': self.blobs.size, 
+                'memo_hits': memo[0], 'memo_misses': memo[1], 
+                'memo_results': memo[2], 'memo_bytes': memo[3]}
+    
     def started_task(self):
         """
         Safely announce that a new task is being started. Used internally; 
@@ -184,6 +1362,8 @@ class BackEnd(FirstBytesProtocol):
         """
         with self.task_mutex:
             self.task_count += 1
+            if self.cluster is not None:
+                self.cluster.counts[self.cluster.slot] = self.task_count
     
     def finished_task(self):
         """
@@ -194,12 +1374,25 @@ class BackEnd(FirstBytesProtocol):
         """
         with self.task_mutex:
             self.task_count -= 1
+            if self.cluster is not None:
+                self.cluster.counts[self.cluster.slot] = self.task_count
+    
+    def total_tasks(self):
+        """
+        The number of tasks running on this backend or, if it was started with 
+        main_prefork(), on all of its processes.
+        """
+        if self.cluster is None:
+            return self.task_count
+        return sum(self.cluster.counts[:])
     
     def stop_server(self):
         """
         Stop receiving connections, wait for all tasks to end, and then 
         terminate the server.
         """
+        if self.cluster is not None:
+            self.cluster.control.value = self.cluster.STOP
         self.stop = True
         while self.task_count:
             time.sleep(END_RESP)
@@ -210,6 +1403,8 @@ class BackEnd(FirstBytesProtocol):
         Do a hard termination of the server. May cause problems if child 
         threads are still running.
         """
+        if self.cluster is not None:
+            self.cluster.control.value = self.cluster.KILL
         self.terminate = True
     
     def main(self):
@@ -219,11 +1414,19 @@ class BackEnd(FirstBytesProtocol):
         """
         try:
             self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            # Don't let connections from a previous run in TIME_WAIT keep us 
+            # from binding after a restart.
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if self.cluster is not None:
+                # Let the kernel spread connections over the processes.
+                self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
             self.sock.bind((self.host, self.port))
             self.sock.listen(5)
             self.sock.settimeout(END_RESP)
             
             self.stop = self.terminate = False
+            if self.pool is not None:
+                self.pool.start()
             
             while not (self.stop or self.terminate):
                 try:
@@ -237,9 +1440,77 @@ class BackEnd(FirstBytesProtocol):
                     self.terminate_server()
                 else:
                     threaded(self._handler, (conn,))
+                if self.cluster is not None:
+                    self.cluster.poll(self)
             
             while not self.terminate:
                 time.sleep(END_RESP)
+                # A KILL may still come while the tasks drain.
+                if self.cluster is not None:
+                    self.cluster.poll(self)
             # We are done, the finally will close the socket.
         finally:
             self.sock.close()
+            if self.process_pool is not None:
+                self.process_pool.shutdown(wait=False)
+    
+    def _fork(self, slot):
+        """
+        Fork off a process running the mainloop, using the task count `slot`. 
+        Returns the pid.
+        """
+        pid = os.fork()
+        if pid:
+            return pid
+        # In the child; never return from here.
+        code = 0
+        try:
+            self.cluster.slot = slot
+            # Its result cache starts out empty anyway.
+            self.cluster.flushed = self.cluster.flushes.value
+            self.main()
+        except BaseException:
+            show_err()
+            code = 1
+        finally:
+            os._exit(code)
+    
+    def main_prefork(self, forks=None):
+        """
+        Runs the mainloop in `forks` (default: the number of CPUs) forked 
+        processes, which all accept connections on the same port, and lets the 
+        kernel spread connections over them. Blocks, supervising the processes 
+        and restarting any that die. STOP or KILL sent to any process applies 
+        to all of them, and STATUS counts the tasks of all of them. FLUSH 
+        empties the result caches of all of them, and STATS sums up their 
+        result cache statistics, though each process keeps its own results 
+        (and its own blobs). Requires os.fork() and SO_REUSEPORT (e.g. Linux 
+        or a BSD).
+        """
+        forks = forks or multiprocessing.cpu_count()
+        self.cluster = cluster = _Cluster(forks)
+        children = {}
+        try:
+            for slot in range(forks):
+                children[self._fork(slot)] = slot
+            
+            while children:
+                pid, status = os.wait()
+                slot = children.pop(pid, None)
+                if slot is None:
+                    continue
+                # Whatever it was running is gone.
+                cluster.forget(slot)
+                if cluster.control.value == cluster.RUN:
+                    self.log(ERROR, 'Backend process %s died (status %s), '
+                                    'restarting it' % (pid, status))
+                    # Don't spin if it dies straight away every time.
+                    time.sleep(END_RESP)
+                    children[self._fork(slot)] = slot
+        except KeyboardInterrupt:
+            # We've been told to quit, and so have the children.
+            cluster.control.value = cluster.KILL
+            for pid in children:
+                os.waitpid(pid, 0)
+        finally:
+            self.cluster = None
@@ -1,14 +1,24 @@
 import time
 import json
 import pickle
+import socket
+import struct
 import sys
+import zlib
+import hashlib
+import binascii
+try:
+    import lzma
+except ImportError:
+    # Python 2; zlib only.
+    lzma = None
 
 from .log import null_logger, ERROR
 
 
-__all__ = ['DEFAULT_PORT', 'STOP', 'KILL', 'STATUS', 'bytes', 'basestring', 
-           'show_err', 'FirstBytesCorruptionError', 'FirstBytesProtocol', 
-           'JSONCodec', 'PickleCodec']
+__all__ = ['DEFAULT_PORT', 'STOP', 'KILL', 'STATUS', 'STATS', 'FLUSH', 'BATCH', 'STREAM', 'HELLO', 'BLOB', 'BUSY', 'MISSING_BLOB', 'bytes', 
+           'basestring', 'show_err', 'FirstBytesCorruptionError', 'FirstBytesProtocol', 
+           'JSONCodec', 'PickleCodec', 'BinaryCodec', 'CompressedCodec']
 
 DEFAULT_PORT = 54543
 
@@ -17,15 +27,78 @@ if bytes is str:
     def bytes(s, enc):
         return s
     basestring = basestring
+    _text = unicode
+    _ints = (int, long)
 else:
     # Python 3
     bytes = bytes
     basestring = str
+    _text = str
+    _ints = (int,)
+
+# The real bytes type, even on Python 2, where `bytes` is shadowed above
+_bytes_type = type(b'')
+
+# Scatter-gather sends aren't available everywhere (e.g. on Windows).
+_sendmsg = getattr(socket.socket, 'sendmsg', None)
+
+# FirstBytes article flags, as seen when indexing a bytearray
+_V1_LAST, _V1_MORE, _V2_LAST, _V2_MORE = bytearray(b'0123')
+_V1_FLAGS = (_V1_LAST, _V1_MORE)
+_V2_FLAGS = (_V2_LAST, _V2_MORE)
+_V2_SIZE = struct.Struct('>I')
+_V2_HEADER = struct.Struct('>cI')
+
+
+# BinaryCodec() type tags, short (< 256 long) and long forms
+_B_NONE, _B_TRUE, _B_FALSE = b'N', b'T', b'F'
+_B_INT8, _B_INT32, _B_INT64, _B_BIGINT = b'c', b'i', b'q', b'I'
+_B_FLOAT = b'f'
+_B_TEXT, _B_TEXT_LONG = b's', b'S'
+_B_BYTES, _B_BYTES_LONG = b'y', b'Y'
+_B_LIST, _B_LIST_LONG = b'l', b'L'
+_B_TUPLE, _B_TUPLE_LONG = b'u', b'U'
+_B_DICT, _B_DICT_LONG = b'd', b'D'
+# ... and the structs that they are packed with
+_B_SHORT = struct.Struct('>cB')
+_B_LONG = struct.Struct('>cI')
+_B_PACK_INT8 = struct.Struct('>cb').pack
+_B_PACK_INT32 = struct.Struct('>ci').pack
+_B_PACK_INT64 = struct.Struct('>cq').pack
+_B_PACK_FLOAT = struct.Struct('>cd').pack
+
+# Same settings as json.dumps() without arguments, minus its argument checks
+_json_encode = json.JSONEncoder().encode
+
+# CompressedCodec() message markers
+_RAW, _ZLIB, _LZMA = b'\x00', b'\x01', b'\x02'
+# The default size (in bytes) above which CompressedCodec() compresses
+COMPRESS_THRESHOLD = 1024
 
 
 STOP = '<stop>'
 KILL = '<kill>'
 STATUS = '<status>'
+STATS = '<stats>'
+FLUSH = '<flush>'
+
+# The built-in task that runs a list of [task, args, kw] calls in one go
+BATCH = '<batch>'
+
+# Wraps a request whose streamed arguments follow it in [id, items] messages
+STREAM = '<stream>'
+
+# Opens a connection by settling its codec and FirstBytes version
+HELLO = '<hello>'
+
+# Marks an argument held by the backend, sent as {BLOB: digest}, or sent 
+# along to be held, as {BLOB: [digest, size, value]}
+BLOB = '<blob>'
+
+# The error type a backend answers with when it is too busy to take a task
+BUSY = 'BackendBusyError'
+# ... and when it doesn't hold the blobs that a request refers to
+MISSING_BLOB = 'BlobMissingError'
 
 
 def show_err():
@@ -34,7 +107,8 @@ def show_err():
 
 class FirstBytesCorruptionError(Exception):
     """
-    Exception raised when the first byte of a FB LMTP message is not a 0 or 1.
+    Exception raised when the first byte of a FB LMTP message is not a valid 
+    article flag, or when the connection breaks in the middle of a message.
     """
 
 
@@ -43,41 +117,141 @@ class FirstBytesProtocol(object):
     """
     A mixin class that has methods for sending and receiving information using 
     the First Bytes long message transfer protocol.
+    
+    Two versions of the protocol are understood. Version 1 articles have a 
+    '0' or '1' flag followed by a 4-digit hexadecimal size, and carry text. 
+    Version 2 articles have a '2' (last) or '3' (more follow) flag followed by 
+    a 4-byte big-endian size, and carry bytes, untouched. Both headers are 5 
+    bytes long, so received messages are recognized by their first byte, and 
+    may be answered in kind.
     """
     
     first = 4
     # '%0<first>x'
     size_insert = '%04x'
+    # Version 2 articles are only split when they would overflow the size 
+    # field.
+    v2_size = 0xffffffff
+    # Larger articles are received in blocks of this size, so that a header 
+    # can't make us set aside more memory than has actually arrived.
+    recv_block = 1 << 20
     
-    def __init__(self, logger=null_logger, data_size=2048):
+    def __init__(self, logger=null_logger, data_size=2048, version=1):
         """
-        data_size -- The maximum length of the data slices created. Will not be 
-                     exceeded, but in many cases will not ever be reached. This 
-                     value can be any positive "short", but the real-world 
-                     network concerns mentioned in the official documentation 
-                     for `socket.recv()` apply here -- be kind to the program 
-                     that your program is communicating with!
+        data_size -- The maximum length of the data slices created for 
+                     version 1 messages. Will not be exceeded, but in many 
+                     cases will not ever be reached. This value can be any 
+                     positive "short", but the real-world network concerns 
+                     mentioned in the official documentation for 
+                     `socket.recv()` apply here -- be kind to the program that 
+                     your program is communicating with!
+        version   -- The protocol version (1 or 2) used for sending, unless 
+                     the caller of send() chooses otherwise. Version 1 peers 
+                     cannot receive version 2 messages.
         """
+        if version not in (1, 2):
+            raise ValueError('Unknown FirstBytes version %r!' % version)
+        self.version = version
         self.set_size(data_size)
         self.log = logger
     
     def _size_bytes(self, size):
         return bytes(self.size_insert % size, 'utf-8')
     
-    def _wire_recv(self, sock, size):
-        left = size
-        data = ''
-        while left:
-            chunk = sock.recv(left).decode()
-            if not chunk:
+    def _wire_recv_into(self, sock, view):
+        """
+        Fill the memoryview `view` straight from the socket.
+        """
+        while view:
+            got = sock.recv_into(view)
+            if not got:
                 raise FirstBytesCorruptionError(
                   'Socket connection or remote codebase is broken!')
-            
-            data += chunk
-            left -= len(chunk)
+            view = view[got:]
+    
+    def _wire_send(self, sock, buffers):
+        """
+        Send a list of buffers with as few copies as possible.
+        """
+        if _sendmsg is None:
+            # Python 2 can't join memoryviews.
+            sock.sendall(b''.join([
+              b.tobytes() if isinstance(b, memoryview) else b 
+              for b in buffers]))
+            return
+        while buffers:
+            sent = _sendmsg(sock, buffers)
+            # Drop whatever made it out, and try again with the rest.
+            while sent:
+                first = len(buffers[0])
+                if sent < first:
+                    buffers[0] = memoryview(buffers[0])[sent:]
+                    break
+                sent -= first
+                buffers.pop(0)
+            while buffers and not len(buffers[0]):
+                buffers.pop(0)
+    
+    def _header(self, header):
+        """
+        Check an article header, returning a (version, size, last) triple. 
+        Used internally, but also by alternative transports such as 
+        taskit.aio.
+        """
+        bit = header[0]
+        if bit in _V2_FLAGS:
+            return 2, _V2_SIZE.unpack_from(header, 1)[0], bit == _V2_LAST
+        if bit in _V1_FLAGS:
+            return 1, int(header[1:].decode(), 16), bit == _V1_LAST
         
+        bit = chr(bit)
+        self.log(ERROR, 'First char %r not a valid article flag!' % bit)
+        raise FirstBytesCorruptionError(
+          'Protocol corruption detected -- '
+          'first char in message was not a 0, 1, 2, or 3!'
+        )
+    
+    def _join(self, version, pieces):
+        """
+        Put a message back together from its article payloads.
+        """
+        # Almost always only one piece; don't copy it again. (Python 2's 
+        # bytes can't join bytearrays.)
+        data = pieces[0] if len(pieces) == 1 else bytearray().join(pieces)
+        if version == 1:
+            return data.decode('utf-8')
+        if _bytes_type is str:
+            # Python 2's json and pickle only take str.
+            return _bytes_type(data)
         return data
     
+    def _articles(self, data, version=None):
+        """
+        Split a message up into articles, yielding a list of buffers (header 
+        and payload) for each. Used internally, but also by alternative 
+        transports such as taskit.aio.
+        """
+        if (version or self.version) == 2:
+            if isinstance(data, _text):
+                data = data.encode('utf-8')
+            ds = self.v2_size
+            last, more = b'2', b'3'
+            pack = lambda flag, size: _V2_HEADER.pack(flag, size)
+        else:
+            data = bytes(data, 'utf-8')
+            ds = self.data_size
+            last, more = b'0', b'1'
+            pack = lambda flag, size: flag + self._size_bytes(size)
+        
+        # Slicing a memoryview doesn't copy.
+        view = memoryview(data)
+        while 1:
+            piece, view = view[:ds], view[ds:]
+            if not view:
+                yield [pack(last, len(piece)), piece]
+                return
+            yield [pack(more, len(piece)), piece]
+    
     def set_size(self, data_size):
         """
         Set the data slice size.
@@ -88,45 +262,37 @@ class FirstBytesProtocol(object):
         
         self.data_size = data_size
     
-    def recv(self, sock):
-        data = ''
-        # Cache the header size for speed
-        hsize = self.first + 1
+    def recv_message(self, sock):
+        """
+        Receive a message, returning a (version, data) pair. Version 1 data is 
+        a string, version 2 data is a bytes-like object.
+        """
+        header = bytearray(self.first + 1)
+        view = memoryview(header)
+        pieces = []
         while 1:
-            header = self._wire_recv(sock, hsize)
-            bit = header[0]
-            if bit not in ('0', '1'):
-                self.log(ERROR, 'First char %r not one of "0" or "1"!' % bit)
-                raise FirstBytesCorruptionError(
-                  'Protocol corruption detected -- '
-                  'first char in message was not a 0 or a 1!'
-                )
-            
-            # So, how big a piece do we need to grab?
-            size = int(header[1:], 16)
-            # Get it.
-            data += self._wire_recv(sock, size)
-            
+            self._wire_recv_into(sock, view)
+            version, size, last = self._header(header)
+            while size:
+                # Receive straight into buffers, a block at most at a time.
+                piece = bytearray(min(size, self.recv_block))
+                self._wire_recv_into(sock, memoryview(piece))
+                pieces.append(piece)
+                size -= len(piece)
             # If nothing else will be sent, then we are finished.
-            if bit == '0':
-                return data
-    
-    def send(self, sock, data):        
-        # Cache max data size for speed
-        ds = self.data_size
-        # Also cache the "max data size"-sized-data prefix
-        norm = b'1' + self._size_bytes(ds)
-        
-        data = bytes(data, 'utf-8')
-        while data:
-            dlen = len(data)
-            if dlen < ds:
-                pre = b'0' + self._size_bytes(dlen)
-            else:
-                pre = norm
-            
-            sock.sendall(pre + data[:ds])
-            data = data[ds:]
+            if last:
+                return version, self._join(version, pieces)
+    
+    def recv(self, sock):
+        return self.recv_message(sock)[1]
+    
+    def send(self, sock, data, version=None):
+        """
+        Send `data` with FirstBytes protocol version `version`, defaulting to 
+        the one this object was created with.
+        """
+        for buffers in self._articles(data, version):
+            self._wire_send(sock, buffers)
 
 
 class JSONCodec(object):
@@ -135,12 +301,19 @@ class JSONCodec(object):
     Standard codec using JSON. Good balance of scope and support.
     """
     
+    name = 'json'
+    
     @staticmethod
     def encode(obj):
         return json.dumps(obj)
     @staticmethod
     def decode(enc):
         return json.loads(enc)
+    @staticmethod
+    def call_encoder(task):
+        # '["task", ' is encoded once, and the rest of the list spliced in.
+        head = json.dumps([task])[:-1] + ', '
+        return lambda rest: head + _json_encode(rest)[1:]
 
 
 class PickleCodec(object):
@@ -150,9 +323,328 @@ class PickleCodec(object):
     cross-language support is desired.
     """
     
+    name = 'pickle'
+    # Its messages are bytes on Python 3, needing FirstBytes version 2.
+    binary = _bytes_type is not str
+    
     @staticmethod
     def encode(obj):
         return pickle.dumps(obj)
     @staticmethod
     def decode(enc):
         return pickle.loads(enc)
+
+
+def _binary_head(out, short, long, size):
+    """
+    Helper function to append a BinaryCodec() tag and size to `out`, using 
+    the short form of the tag when the size fits in a byte.
+    """
+    if size < 256:
+        out.append(_B_SHORT.pack(short, size))
+    else:
+        out.append(_B_LONG.pack(long, size))
+
+
+def _binary_encode(obj, out):
+    """
+    Helper function to append the BinaryCodec() encoding of `obj` to the list 
+    of byte strings `out`.
+    """
+    kind = type(obj)
+    # Roughly from most to least common.
+    if kind is _text:
+        data = obj.encode('utf-8')
+        _binary_head(out, _B_TEXT, _B_TEXT_LONG, len(data))
+        out.append(data)
+    elif kind in _ints and -0x80 <= obj < 0x80:
+        out.append(_B_PACK_INT8(_B_INT8, obj))
+    elif kind is list:
+        _binary_head(out, _B_LIST, _B_LIST_LONG, len(obj))
+        for item in obj:
+            _binary_encode(item, out)
+    elif kind is dict:
+        _binary_head(out, _B_DICT, _B_DICT_LONG, len(obj))
+        for key, value in obj.items():
+            _binary_encode(key, out)
+            _binary_encode(value, out)
+    elif kind in _ints:
+        if -0x80000000 <= obj < 0x80000000:
+            out.append(_B_PACK_INT32(_B_INT32, obj))
+        elif -0x8000000000000000 <= obj < 0x8000000000000000:
+            out.append(_B_PACK_INT64(_B_INT64, obj))
+        else:
+            # Two's complement, with room for the sign bit.
+            size = (obj.bit_length() + 8) // 8
+            digits = obj + (1 << (size * 8)) if obj < 0 else obj
+            out.append(_B_LONG.pack(_B_BIGINT, size))
+            out.append(binascii.unhexlify('%0*x' % (size * 2, digits)))
+    elif kind is float:
+        out.append(_B_PACK_FLOAT(_B_FLOAT, obj))
+    elif obj is None:
+        out.append(_B_NONE)
+    elif obj is True:
+        out.append(_B_TRUE)
+    elif obj is False:
+        out.append(_B_FALSE)
+    elif kind is tuple:
+        _binary_head(out, _B_TUPLE, _B_TUPLE_LONG, len(obj))
+        for item in obj:
+            _binary_encode(item, out)
+    elif isinstance(obj, (_bytes_type, bytearray, memoryview)):
+        data = _bytes_type(obj)
+        _binary_head(out, _B_BYTES, _B_BYTES_LONG, len(data))
+        out.append(data)
+    else:
+        # Subclasses, e.g. of int or dict, are sent as their base type.
+        for base in _ints + (_text, list, tuple, dict, float):
+            if isinstance(obj, base):
+                return _binary_encode(base(obj), out)
+        raise TypeError('%r is not BinaryCodec serializable' % (obj,))
+
+
+def _binary_decode(data, pos):
+    """
+    Helper function to decode the BinaryCodec() value starting at `pos` in 
+    `data`, returning it along with the position after it.
+    """
+    try:
+        decoder = _B_DECODERS[data[pos:pos + 1]]
+    except KeyError:
+        raise ValueError('Unknown BinaryCodec type tag %r at %d' % 
+                         (data[pos:pos + 1], pos))
+    return decoder(data, pos + 1)
+
+
+def _binary_size(data, pos, long):
+    """
+    Helper function to read the size of a BinaryCodec() value, returning it 
+    along with the position after it.
+    """
+    if long:
+        return _B_LONG.unpack_from(data, pos - 1)[1], pos + 4
+    return _B_SHORT.unpack_from(data, pos - 1)[1], pos + 1
+
+
+def _binary_decoder(kind, long=False):
+    """
+    Helper function to build the decoding function for the BinaryCodec() 
+    values of type `kind`.
+    """
+    if kind is _text or kind is _bytes_type:
+        def decode(data, pos):
+            size, pos = _binary_size(data, pos, long)
+            value = data[pos:pos + size]
+            if kind is _text:
+                value = value.decode('utf-8')
+            return value, pos + size
+    elif kind is list or kind is tuple:
+        def decode(data, pos):
+            size, pos = _binary_size(data, pos, long)
+            items = []
+            for i in range(size):
+                item, pos = _B_DECODERS[data[pos:pos + 1]](data, pos + 1)
+                items.append(item)
+            return (items if kind is list else tuple(items)), pos
+    elif kind is dict:
+        def decode(data, pos):
+            size, pos = _binary_size(data, pos, long)
+            items = {}
+            for i in range(size):
+                key, pos = _B_DECODERS[data[pos:pos + 1]](data, pos + 1)
+                items[key], pos = _B_DECODERS[data[pos:pos + 1]](data, pos + 1)
+            return items, pos
+    else:
+        # A fixed-size struct, given as `kind`, read along with its tag.
+        unpack_from = kind.unpack_from
+        size = kind.size - 1
+        def decode(data, pos):
+            return unpack_from(data, pos - 1)[1], pos + size
+    return decode
+
+
+def _binary_bigint(data, pos):
+    size, pos = _binary_size(data, pos, True)
+    value = int(binascii.hexlify(data[pos:pos + size]), 16)
+    if size and bytearray(data[pos:pos + 1])[0] & 0x80:
+        value -= 1 << (size * 8)
+    return value, pos + size
+
+
+_B_DECODERS = {
+  _B_NONE: lambda data, pos: (None, pos), 
+  _B_TRUE: lambda data, pos: (True, pos), 
+  _B_FALSE: lambda data, pos: (False, pos), 
+  _B_INT8: _binary_decoder(struct.Struct('>cb')), 
+  _B_INT32: _binary_decoder(struct.Struct('>ci')), 
+  _B_INT64: _binary_decoder(struct.Struct('>cq')), 
+  _B_BIGINT: _binary_bigint, 
+  _B_FLOAT: _binary_decoder(struct.Struct('>cd')), 
+  _B_TEXT: _binary_decoder(_text), 
+  _B_TEXT_LONG: _binary_decoder(_text, True), 
+  _B_BYTES: _binary_decoder(_bytes_type), 
+  _B_BYTES_LONG: _binary_decoder(_bytes_type, True), 
+  _B_LIST: _binary_decoder(list), 
+  _B_LIST_LONG: _binary_decoder(list, True), 
+  _B_TUPLE: _binary_decoder(tuple), 
+  _B_TUPLE_LONG: _binary_decoder(tuple, True), 
+  _B_DICT: _binary_decoder(dict), 
+  _B_DICT_LONG: _binary_decoder(dict, True), 
+}
+
+
+class BinaryCodec(object):
+    
+    """
+    A compact, self-describing binary codec built on struct. It is faster 
+    than JSON, and, unlike it, keeps tuples and bytes apart from lists and 
+    strings; unlike pickle, it is safe to decode untrusted messages with, and 
+    simple to implement in other languages. Carries None, bools, ints of any 
+    size, floats, bytes, text, lists, tuples and dicts. 
+    
+    The messages are bytes, so FirstBytes version 2 is needed.
+    """
+    
+    name = 'binary'
+    binary = True
+    
+    @staticmethod
+    def encode(obj):
+        out = []
+        _binary_encode(obj, out)
+        return b''.join(out)
+    @staticmethod
+    def decode(enc):
+        if not isinstance(enc, _bytes_type):
+            enc = _bytes_type(enc)
+        obj, pos = _binary_decode(enc, 0)
+        if pos != len(enc):
+            raise ValueError('Trailing data after BinaryCodec value')
+        return obj
+    @staticmethod
+    def call_encoder(task):
+        name = []
+        _binary_encode(task, name)
+        name = b''.join(name)
+        def encode(rest):
+            out = [_B_SHORT.pack(_B_LIST, len(rest) + 1), name]
+            for item in rest:
+                _binary_encode(item, out)
+            return b''.join(out)
+        return encode
+
+
+class CompressedCodec(object):
+    
+    """
+    Wraps another codec, compressing the messages that it produces when they 
+    are larger than `threshold` bytes, so that big payloads take less 
+    bandwidth while small calls pay nothing for it:
+      FrontEnd(backends, codec=CompressedCodec(JSONCodec, 'lzma'), protocol=2)
+    Each message starts with a byte that marks it as raw or compressed (and 
+    how), so the receiving end needs no settings of its own, and either 
+    method is read whatever `method` is. A backend using this codec still 
+    serves clients that only use `codec`, answering them in kind. 
+    
+    The messages are bytes, so FirstBytes version 2 is needed.
+    """
+    
+    binary = True
+    
+    def __init__(self, codec=JSONCodec, method='zlib', level=None, 
+                 threshold=COMPRESS_THRESHOLD):
+        """
+        codec     -- The codec to wrap. 
+        method    -- 'zlib' or 'lzma' (Python 3 only). zlib is much faster; 
+                     lzma compresses better. 
+        level     -- The zlib level (1-9) or lzma preset (0-9) to use, 
+                     trading speed for size. Defaults to the library's 
+                     default (6 for both). 
+        threshold -- The size (in bytes) above which messages are 
+                     compressed. Messages that don't shrink are sent raw.
+        """
+        if method == 'zlib':
+            level = zlib.Z_DEFAULT_COMPRESSION if level is None else level
+            self._compress = lambda data: zlib.compress(data, level)
+            self._marker = _ZLIB
+        elif method == 'lzma':
+            if lzma is None:
+                raise ValueError('lzma is not available')
+            self._compress = lambda data: lzma.compress(data, preset=level)
+            self._marker = _LZMA
+        else:
+            raise ValueError('Unknown compression method %r!' % method)
+        self.codec = codec
+        name = getattr(codec, 'name', None)
+        self.name = None if name is None else 'compressed+%s' % name
+        self.method = method
+        self.level = level
+        self.threshold = threshold
+    
+    def for_message(self, data):
+        """
+        The codec to answer a connection with, given its first message: this 
+        one, or the wrapped one for clients that don't use it.
+        """
+        if data[:1] in (_RAW, _ZLIB, _LZMA):
+            return self
+        return self.codec
+    
+    def encode(self, obj):
+        return self._pack(self.codec.encode(obj))
+    
+    def call_encoder(self, task):
+        encode = _call_encoder(self.codec, task)
+        return lambda rest: self._pack(encode(rest))
+    
+    def _pack(self, data):
+        if isinstance(data, _text):
+            data = data.encode('utf-8')
+        if len(data) > self.threshold:
+            packed = self._compress(data)
+            if len(packed) < len(data):
+                return self._marker + packed
+        return _RAW + data
+    
+    def decode(self, enc):
+        marker = enc[:1]
+        if marker == _RAW:
+            data = enc[1:]
+        elif marker == _ZLIB:
+            data = zlib.decompress(enc[1:])
+        elif marker == _LZMA:
+            if lzma is None:
+                raise ValueError('lzma is not available')
+            data = lzma.decompress(_bytes_type(enc[1:]))
+        else:
+            raise ValueError('Unknown CompressedCodec marker %r!' % marker)
+        if isinstance(data, bytearray):
+            data = _bytes_type(data)
+        return self.codec.decode(data)
+
+
+def _blob_digest(value, codec):
+    """
+    Helper function to get the (digest, size) pair that a Blob() is known 
+    by: the SHA-256 digest and length of `value` encoded with `codec`. 
+    Compression is left out, so that both ends agree whatever their settings.
+    """
+    if isinstance(codec, CompressedCodec):
+        codec = codec.codec
+    data = codec.encode(value)
+    if isinstance(data, basestring):
+        data = bytes(data, 'utf-8')
+    return hashlib.sha256(data).hexdigest(), len(data)
+
+
+def _call_encoder(codec, task):
+    """
+    Helper function to get a function encoding [`task`] + rest with `codec`, 
+    for calls to the same task over and over. Codecs may speed these up with 
+    a call_encoder(task) method, e.g. by encoding `task` only once; the 
+    result must be the same as that of encode().
+    """
+    make = getattr(codec, 'call_encoder', None)
+    if make is None:
+        return lambda rest: codec.encode([task] + rest)
+    return make(task)
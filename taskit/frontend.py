@@ -2,15 +2,49 @@
 This is the frontend to the distributed version of TaskIt.
 """
 
+import time
+import errno
 import socket
+import random
+import functools
+import itertools
+try:
+    from queue import Queue
+except ImportError:
+    # Python 2
+    from Queue import Queue
 
 from .threaded import *
 from .common import *
+from .common import _blob_digest, _call_encoder
 from .log import *
-from .simple import null_cb
+from .simple import null_cb, get_executor
+from .resync import Mediator, Resyncer, Channel, ResyncWaitTimeout
 
 
-__all__ = ['BackendNotAvailableError', 'BackendProcessingError', 'FrontEnd']
+__all__ = ['BackendNotAvailableError', 'BackendBusyError', 
+           'BackendProcessingError', 'ConnectionPool', 'MultiplexedConnection', 
+           'BackendHealth', 'Coalescer', 'Streamed', 'Blob', 'PreparedTask', 
+           'FrontEnd']
+
+POOL_SIZE = 4
+POOL_IDLE = 30
+
+# The load given to a backend that the load monitor could not reach
+DOWN_LOAD = float('inf')
+
+# The default number of calls sent in each map() message
+CHUNKSIZE = 64
+# The default number of calls after which coalesced calls are sent right away
+COALESCE_SIZE = 64
+# The default size of the blocks that Streamed() files are read in
+BLOCKSIZE = 65536
+# How long to wait for the upload of a broken call to fail along with it
+UPLOAD_WAIT = 1
+
+FAILURE_LIMIT = 3
+RETRY = 1
+RETRY_MAX = 60
 
 
 class BackendNotAvailableError(Exception):
@@ -20,6 +54,14 @@ class BackendNotAvailableError(Exception):
     """
 
 
+class BackendBusyError(BackendNotAvailableError):
+    """
+    Error raised (without arguments) when a backend was reached, but was too 
+    busy to take the task. work() treats this like an unreachable backend and 
+    moves on to the next one.
+    """
+
+
 class BackendProcessingError(Exception):
     
     """
@@ -45,6 +87,604 @@ class BackendProcessingError(Exception):
                                          self.type, self.args)
 
 
+def _dropped(sock):
+    """
+    Helper function to check whether the backend has closed an idle socket 
+    (or sent something on it unasked), which makes it useless. Peeks without 
+    blocking, rather than using select(), which can't take descriptors past 
+    FD_SETSIZE.
+    """
+    timeout = sock.gettimeout()
+    sock.settimeout(0)
+    try:
+        sock.recv(1, socket.MSG_PEEK)
+    except socket.error as e:
+        return e.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK)
+    finally:
+        sock.settimeout(timeout)
+    # Either closed, or out of step with the backend.
+    return True
+
+
+def _answered(sock):
+    """
+    Helper function to wait for the first byte of the response on `sock`, 
+    returning False if the backend closed it without sending any.
+    """
+    try:
+        return bool(sock.recv(1, socket.MSG_PEEK))
+    except socket.error:
+        return False
+
+
+class ConnectionPool(object):
+    
+    """
+    Keeps idle, already-connected sockets to a single backend so that they can 
+    be reused for later tasks instead of paying for a new TCP connection (and 
+    an ephemeral port) every time. Backends that close connections after one 
+    request (as older ones do) are noticed the first time that a reused 
+    socket goes unanswered, and get a new connection for every task from 
+    then on.
+    """
+    
+    def __init__(self, backend, size=POOL_SIZE, idle=POOL_IDLE, 
+                 codec=JSONCodec, version=1, handshake=None):
+        """
+        backend   -- The (host, port) pair that sockets are connected to. 
+        size      -- The maximum number of idle sockets that will be kept. Any 
+                     sockets returned beyond this will simply be closed. 
+        idle      -- The time (in seconds) that a socket may sit unused in 
+                     the pool before it is considered stale and evicted. This 
+                     should be shorter than the keep-alive time of the 
+                     backend. 
+        codec     -- The codec used with the backend. 
+        version   -- The FirstBytes version used with the backend. 
+        handshake -- If given, called with the pool and each new socket 
+                     before it is used. It may change `codec` and `version`, 
+                     or set `handshake` to None to stop shaking hands.
+        """
+        self.backend = backend
+        self.size = size
+        self.idle = idle
+        self.codec = codec
+        self.version = version
+        self.handshake = handshake
+        # Whether the backend serves more than one request per connection: 
+        # None until a reused socket is answered, or turns out to be closed.
+        self.keeps_alive = None
+        # (socket, time last used) pairs, most recently used last
+        self.sockets = []
+        self.mutex = allocate_lock()
+    
+    def connect(self):
+        """
+        Open a brand-new connection to the backend, bypassing the pool.
+        """
+        handshake = self.handshake
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # Multi-article messages on a long-lived connection would otherwise 
+        # wait on delayed ACKs.
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            sock.connect(self.backend)
+            if self.handshake is not None:
+                self.handshake(self, sock)
+        except Exception:
+            sock.close()
+            raise
+        if self.handshake is None and handshake is not None:
+            # Turned down, by a backend that may well have hung up since.
+            sock.close()
+            return self.connect()
+        return sock
+    
+    def get(self):
+        """
+        Get a (socket, reused) pair. `reused` is True if the socket came out of 
+        the pool. Sockets that the backend has closed are skipped, but it may 
+        still close one just as it is handed out.
+        """
+        stale = []
+        cutoff = time.time() - self.idle
+        with self.mutex:
+            while self.sockets:
+                sock, used = self.sockets.pop()
+                if used <= cutoff:
+                    # The most recently used socket is stale, so all of them 
+                    # are.
+                    stale += [sock] + [s for s, used in self.sockets]
+                    self.sockets = []
+                elif _dropped(sock):
+                    stale.append(sock)
+                else:
+                    return sock, True
+        for sock in stale:
+            sock.close()
+        return self.connect(), False
+    
+    def put(self, sock):
+        """
+        Return a healthy socket to the pool, or close it if the pool is full 
+        or the backend doesn't keep connections alive.
+        """
+        with self.mutex:
+            if len(self.sockets) < self.size and self.keeps_alive is not False:
+                self.sockets.append((sock, time.time()))
+                return
+        sock.close()
+    
+    def clear(self):
+        """
+        Close all idle sockets.
+        """
+        with self.mutex:
+            sockets, self.sockets = self.sockets, []
+        for sock, used in sockets:
+            sock.close()
+
+
+class MultiplexedConnection(object):
+    
+    """
+    A connection shared by many concurrent tasks. Every request carries an id, 
+    and a reader thread hands each response to the task waiting on that id, in 
+    whatever order the backend finishes them. The items of a streamed response 
+    are gathered up for a regular request, or passed on as they come for a 
+    streaming one.
+    """
+    
+    def __init__(self, frontend, sock, codec=None, version=None):
+        """
+        frontend -- The FrontEnd() whose logger will be used. 
+        sock     -- A connected socket, which now belongs to this object. 
+        codec    -- The codec to use; defaults to the frontend's. 
+        version  -- The FirstBytes version to use; defaults to the 
+                    frontend's.
+        """
+        self.frontend = frontend
+        self.sock = sock
+        self.codec = codec or frontend.codec
+        self.version = version or frontend.version
+        self.waiters = {}
+        self.partial = {}
+        self.broken = None
+        self.last_used = time.time()
+        self.mutex = allocate_lock()
+        self.send_mutex = allocate_lock()
+        threaded(self._reader, ())
+    
+    def __len__(self):
+        """
+        The number of requests waiting on a response.
+        """
+        return len(self.waiters)
+    
+    def _reader(self):
+        """
+        Reader thread. Dispatches responses until the connection breaks.
+        """
+        fe = self.frontend
+        try:
+            while 1:
+                incoming = fe.recv(self.sock)
+                fe.log(DEBUG, incoming)
+                result = self.codec.decode(incoming)
+                rid = result[-1]
+                try:
+                    with self.mutex:
+                        if result[0] == 'yield':
+                            waiter = self.waiters[rid]
+                        else:
+                            waiter = self.waiters.pop(rid)
+                except (KeyError, TypeError):
+                    raise FirstBytesCorruptionError(
+                      'Response does not match any request -- does the '
+                      'backend support multiplexing?')
+                
+                if isinstance(waiter, Channel):
+                    waiter.put(result[:-1])
+                    if result[0] != 'yield':
+                        waiter.close()
+                elif result[0] == 'yield':
+                    self.partial.setdefault(rid, []).extend(result[1])
+                else:
+                    items = self.partial.pop(rid, None)
+                    if items is not None and result[0] == 'success':
+                        result = ['success', items, rid]
+                    waiter.set_result(result[:-1])
+        except Exception as e:
+            self._break(e)
+    
+    def _break(self, e):
+        """
+        Mark the connection as broken and pass `e` on to all waiting tasks.
+        """
+        with self.mutex:
+            if self.broken is None:
+                self.broken = e
+            waiters, self.waiters = self.waiters, {}
+            self.partial = {}
+        self.sock.close()
+        for waiter in waiters.values():
+            if isinstance(waiter, Channel):
+                waiter.close(e)
+            else:
+                waiter.set_error(e)
+    
+    def request(self, rid, package, stream=False):
+        """
+        Send `package`, which must have been packaged with the request id 
+        `rid`, and return a `Mediator()` that will receive the decoded 
+        response (without the id). With `stream`, return a `Channel()` that 
+        will receive each decoded message of a streamed response instead, and 
+        will be closed after the last one.
+        """
+        waiter = Channel() if stream else Mediator()
+        with self.mutex:
+            if self.broken is not None:
+                raise self.broken
+            self.waiters[rid] = waiter
+        self.last_used = time.time()
+        try:
+            with self.send_mutex:
+                self.frontend.send(self.sock, _encoded(package, self.codec), 
+                                   self.version)
+        except Exception as e:
+            self._break(e)
+            raise
+        return waiter
+    
+    def close(self):
+        """
+        Close the connection. Tasks still waiting on it will get an error.
+        """
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self._break(socket.error('Connection closed by the client'))
+
+
+class BackendHealth(object):
+    
+    """
+    A circuit breaker for a single backend. After `limit` connection failures 
+    in a row the backend is considered down, and FrontEnd.work() skips it 
+    instead of waiting on yet another failed connect(). Meanwhile, the 
+    backend is probed with exponentially increasing delays, and let back in 
+    as soon as it can be reached.
+    """
+    
+    def __init__(self, limit=FAILURE_LIMIT, retry=RETRY, retry_max=RETRY_MAX):
+        """
+        limit     -- The number of failures in a row after which the backend 
+                     is considered down. 0 means never. 
+        retry     -- The delay (in seconds) before the first probe. 
+        retry_max -- The longest delay between probes.
+        """
+        self.limit = limit
+        self.retry = retry
+        self.retry_max = retry_max
+        self.up = True
+        self.failures = 0
+        self.consecutive = 0
+        self.delay = retry
+        self.down_since = None
+        self.mutex = allocate_lock()
+    
+    def failed(self):
+        """
+        Count a failure. Returns True if it took the backend down.
+        """
+        with self.mutex:
+            self.failures += 1
+            self.consecutive += 1
+            if self.up and self.limit and self.consecutive >= self.limit:
+                self.up = False
+                self.down_since = time.time()
+                self.delay = self.retry
+                return True
+        return False
+    
+    def succeeded(self):
+        """
+        Note that the backend could be reached, bringing it back up.
+        """
+        # The common case; no need to lock.
+        if self.up and not self.consecutive:
+            return
+        with self.mutex:
+            self.up = True
+            self.consecutive = 0
+            self.down_since = None
+    
+    def backoff(self):
+        """
+        Note that a probe failed, doubling the delay before the next one.
+        """
+        with self.mutex:
+            self.delay = min(self.delay * 2, self.retry_max)
+    
+    def as_dict(self):
+        """
+        Get the state as a dict: whether the backend is `up`, its total 
+        number of `failures`, the number of `consecutive` ones, when it went 
+        down (`down_since`), and the delay before the next probe (`retry_in`).
+        """
+        return {'up': self.up, 'failures': self.failures, 
+                'consecutive': self.consecutive, 'down_since': self.down_since, 
+                'retry_in': None if self.up else self.delay}
+
+
+class Coalescer(object):
+    
+    """
+    Gathers up concurrent FrontEnd.work() calls, and sends them as a single 
+    BATCH once `wait` seconds have passed since the first one, or as soon as 
+    there are `size` of them. Each caller still gets its own result or error.
+    """
+    
+    def __init__(self, frontend, wait, size=COALESCE_SIZE):
+        self.frontend = frontend
+        self.wait = wait
+        self.size = size
+        self.calls = []
+        self.mediators = []
+        # Tells the timer whether the batch that it was started for is still 
+        # waiting.
+        self.generation = 0
+        self.mutex = allocate_lock()
+    
+    def _take(self):
+        """
+        Take the waiting calls. Must be called with the mutex held.
+        """
+        batch = self.calls, self.mediators
+        self.calls, self.mediators = [], []
+        self.generation += 1
+        return batch
+    
+    def _timer(self, generation):
+        time.sleep(self.wait)
+        with self.mutex:
+            if generation != self.generation:
+                # Already sent for being full.
+                return
+            batch = self._take()
+        self._send(*batch)
+    
+    def _send(self, calls, mediators):
+        """
+        Send a batch, and hand each caller its result.
+        """
+        try:
+            responses = self.frontend._work_routed(BATCH, [calls], {})
+        except Exception as e:
+            for mediator in mediators:
+                mediator.set_error(e)
+            return
+        for mediator, res in zip(mediators, responses):
+            if res[0] == 'success':
+                mediator.set_result(res[1])
+            else:
+                mediator.set_error(BackendProcessingError(*res[1:]))
+    
+    def call(self, task, args, kw):
+        """
+        Add a call to the batch, and wait for its result.
+        """
+        mediator = Mediator()
+        batch = None
+        with self.mutex:
+            self.calls.append([task, list(args), kw])
+            self.mediators.append(mediator)
+            if len(self.calls) >= self.size:
+                batch = self._take()
+            elif len(self.calls) == 1:
+                threaded(self._timer, (self.generation,))
+        if batch is not None:
+            # This caller filled the batch, so it does the sending.
+            self._send(*batch)
+        return mediator.get()
+
+
+def _encoded(package, codec):
+    """
+    Helper function to get a package as encoded with `codec`.
+    """
+    if type(package) is _Call:
+        return package.encode(codec)
+    return package
+
+
+class _Call(object):
+    
+    """
+    A request packaged by a FrontEnd() that offers codecs to its backends, 
+    which may not all agree on the same one. It is encoded with each codec 
+    the first time that it is sent with it. The calls of a PreparedTask() 
+    leave the task out of `call`, and are encoded by it.
+    """
+    
+    def __init__(self, call, prepared=None):
+        self.call = call
+        self.prepared = prepared
+        self.encoded = {}
+    
+    def encode(self, codec):
+        data = self.encoded.get(codec)
+        if data is None:
+            if self.prepared is None:
+                data = codec.encode(self.call)
+            else:
+                data = self.prepared.encoder(codec)(self.call)
+            self.encoded[codec] = data
+        return data
+
+
+def _has_special(args, kw, kinds=None):
+    """
+    Helper function to check whether any of the arguments of a call are 
+    Streamed() or Blob()s, or of the types in `kinds`, if given.
+    """
+    kinds = kinds or (Streamed, Blob)
+    for arg in args:
+        if isinstance(arg, kinds):
+            return True
+    if kw:
+        for arg in kw.values():
+            if isinstance(arg, kinds):
+                return True
+    return False
+
+
+def _placeholder(arg, uploads, codec, inline):
+    """
+    Helper function to swap a Streamed() argument for the placeholder that 
+    the backend replaces with an iterator, adding it to `uploads`, and a 
+    Blob() for its digest, or for its digest and value if `inline`.
+    """
+    if isinstance(arg, Streamed):
+        uploads.append(arg)
+        return {STREAM: len(uploads) - 1}
+    if isinstance(arg, Blob):
+        return arg.placeholder(codec, inline)
+    return arg
+
+
+class Streamed(object):
+    
+    """
+    Wraps an iterable or a file-like object to be passed to a task piece by 
+    piece, rather than all at once:
+      frontend.work('count_words', Streamed(open('huge.txt')))
+    The task gets an iterator over the items (for a file, over the blocks 
+    read from it) that is fed as they arrive, so neither end has to hold the 
+    whole input in memory. Binary files need a codec that can carry bytes.
+    
+    Several Streamed() arguments are sent side by side, so the task should 
+    consume them side by side as well (e.g. with zip()). A task given one 
+    can't be run in another process or as part of a batch, and calls with 
+    them are neither multiplexed nor coalesced. Since the source can only be 
+    read once, a call is not tried on another backend once sending started.
+    """
+    
+    def __init__(self, source, chunksize=CHUNKSIZE, blocksize=BLOCKSIZE):
+        """
+        source    -- An iterable, or a file-like object with a read() method. 
+        chunksize -- The most items of an iterable sent in one message. 
+        blocksize -- The size of the blocks that a file is read and sent in.
+        """
+        self.source = source
+        self.chunksize = chunksize
+        self.blocksize = blocksize
+        self.started = False
+    
+    def chunks(self):
+        """
+        Yield the lists of items to be sent.
+        """
+        self.started = True
+        read = getattr(self.source, 'read', None)
+        if read is not None:
+            while 1:
+                block = read(self.blocksize)
+                if not block:
+                    return
+                yield [block]
+        iterator = iter(self.source)
+        while 1:
+            chunk = list(itertools.islice(iterator, self.chunksize))
+            if not chunk:
+                return
+            yield chunk
+
+
+class Blob(object):
+    
+    """
+    Wraps a large argument that is passed to tasks over and over, such as a 
+    lookup table, so that it is sent to each backend only once:
+      table = Blob(load_table())
+      for word in words:
+          frontend.work('lookup', table, word)
+    Requests refer to it by the digest of its encoded contents, and the 
+    backend keeps it in its BlobStore(). Backends that don't hold it (yet, or 
+    any more) answer with a BlobMissingError, and the call is sent again, 
+    this time with the value. 
+    
+    The value is encoded and hashed once, when first sent, so it must not 
+    be modified afterwards; neither may tasks modify it. Blob() arguments 
+    are always sent along with the calls of stream() and those with 
+    Streamed() arguments. They can't be passed to map() or starmap().
+    """
+    
+    def __init__(self, value):
+        self.value = value
+        self.digest = None
+        self.size = None
+    
+    def placeholder(self, codec, inline=False):
+        """
+        Get the placeholder that the backend replaces with the value: its 
+        digest, or, if `inline`, its digest and size along with the value 
+        itself. The digest is that of the value encoded with `codec`, less 
+        any compression; backends check it against the value.
+        """
+        if self.digest is None:
+            self.digest, self.size = _blob_digest(self.value, codec)
+        if inline:
+            return {BLOB: [self.digest, self.size, self.value]}
+        return {BLOB: self.digest}
+
+
+class PreparedTask(object):
+    
+    """
+    A handle for calling one task over and over, as returned by 
+    FrontEnd.prepare(). Calling it is the same as calling work() with the 
+    task, but the task name is encoded only once per codec, and only the 
+    arguments are encoded for each call. Calls with Streamed() arguments, 
+    and calls on a FrontEnd() that coalesces them, simply go through work().
+    
+    The handle of an AsyncFrontEnd() gives a coroutine when called, just like 
+    its work().
+    """
+    
+    def __init__(self, frontend, task):
+        self.frontend = frontend
+        self.task = task
+        self.encoders = {}
+    
+    def __call__(self, *args, **kw):
+        fe = self.frontend
+        if fe.coalescer is not None or _has_special(args, kw):
+            return fe.work(self.task, *args, **kw)
+        rid = fe._next_id()
+        if rid is None:
+            rest = [args, kw]
+        else:
+            rest = [args, kw, rid]
+        if fe.offers:
+            package = _Call(rest, self)
+        else:
+            package = self.encoder(fe.codec)(rest)
+        return fe._route(self.task, package, rid)
+    
+    def __repr__(self):
+        return '%s(%r)' % (type(self).__name__, self.task)
+    
+    def encoder(self, codec):
+        """
+        Get the function encoding calls to this task with `codec`. 
+        """
+        encode = self.encoders.get(codec)
+        if encode is None:
+            encode = self.encoders[codec] = _call_encoder(codec, self.task)
+        return encode
+
+
 class FrontEnd(FirstBytesProtocol):
     
     """
@@ -52,7 +692,11 @@ class FrontEnd(FirstBytesProtocol):
     """
     
     def __init__(self, backends=(), default_port=DEFAULT_PORT, 
-                 logger=null_logger, codec=JSONCodec):
+                 logger=null_logger, codec=JSONCodec, pool_size=POOL_SIZE, 
+                 pool_idle=POOL_IDLE, multiplex=False, protocol=1, 
+                 monitor=None, failure_limit=FAILURE_LIMIT, retry=RETRY, 
+                 coalesce=None, coalesce_size=COALESCE_SIZE, executor=None, 
+                 codecs=None):
         """
         backends     -- A list consisting of host strings or (host, port) 
                         pairs. For the portless strings, default_port will be 
@@ -60,15 +704,87 @@ class FrontEnd(FirstBytesProtocol):
         default_port -- The port to use for backends not specifying a port. 
         logger       -- A logger supporting the taskit.log interface. 
         codec        -- A codec to be used in converting messages into strings.
+        pool_size    -- The number of idle connections kept open to each 
+                        backend. 0 disables connection reuse. Backends 
+                        that close connections after each request are 
+                        detected, and not reused. 
+        pool_idle    -- The time (in seconds) after which an idle pooled 
+                        connection is discarded.
+        multiplex    -- Whether to share connections between concurrent tasks 
+                        by tagging each request with an id. At most 
+                        `pool_size` (and at least one) connections are then 
+                        opened to each backend. Requires backends that 
+                        understand multiplexed requests. 
+        protocol     -- The FirstBytes protocol version to use. Version 2 is 
+                        binary-safe (needed for e.g. PickleCodec on Python 
+                        3) and faster for large messages, but requires 
+                        backends that understand it. Backends answer in the 
+                        version that they were asked in. Codecs whose 
+                        messages are bytes (those with a true `binary` 
+                        attribute) need version 2, and are refused with 
+                        version 1. 
+        monitor      -- If given, the interval (in seconds) at which to poll 
+                        each backend for its load in the background. See 
+                        start_monitor(). 
+        failure_limit -- The number of connection failures in a row after 
+                        which a backend is skipped until it can be reached 
+                        again. 0 disables this. See BackendHealth(). 
+        retry        -- The delay (in seconds) before a skipped backend is 
+                        first probed. It doubles with every failed probe. 
+        coalesce     -- If given, work() holds each call for up to this long 
+                        (in seconds), so that calls made meanwhile from other 
+                        threads can be sent along with it as one batch. This 
+                        adds a little latency, but saves a lot of round-trips 
+                        when many threads make small calls at once. Requires 
+                        backends that know BATCH. 
+        coalesce_size -- The number of held calls that are sent right away, 
+                        without waiting any longer. 
+        executor     -- The `concurrent.futures.Executor()` that submit() runs 
+                        on. Defaults to the shared one from 
+                        `taskit.simple.get_executor()`. 
+        codecs       -- If given, codecs to use instead of `codec` where 
+                        backends support them, best first, e.g. 
+                        [BinaryCodec]. Every new connection then starts with 
+                        a HELLO handshake, in `codec` and `protocol`, that 
+                        settles on the first of them that the backend knows 
+                        and on the newest FirstBytes version that both ends 
+                        speak. Backends too old to know HELLO are spoken to 
+                        with `codec` and `protocol` as before, so a fleet can 
+                        be moved over gradually.
         """
-        FirstBytesProtocol.__init__(self, logger)
+        FirstBytesProtocol.__init__(self, logger, version=protocol)
+        if protocol == 1 and getattr(codec, 'binary', False):
+            raise ValueError('Codecs whose messages are bytes need '
+                             'protocol=2!')
         
         self.default_port = default_port
         self.backends = {}
+        self.backend_list = []
+        self.remote_load = {}
+        self.breakers = {}
+        self.failure_limit = failure_limit
+        self.retry = retry
         self.task_counter = {}
+        self.pools = {}
+        self.pool_size = pool_size
+        self.pool_idle = pool_idle
+        self.multiplex = multiplex
+        self.shared = {}
+        self.request_ids = itertools.count(1)
         self.codec = codec
+        self.offers = [c.name for c in codecs or ()]
+        self.offered = dict((c.name, c) for c in codecs or ())
         self.add_backends(*backends)
         self.backend_mutex = allocate_lock()
+        self.shared_mutex = allocate_lock()
+        self.monitor_interval = None
+        self.monitor_generation = 0
+        self.executor = executor
+        self.coalescer = None
+        if coalesce:
+            self.coalescer = Coalescer(self, coalesce, coalesce_size)
+        if monitor:
+            self.start_monitor(monitor)
     
     def _sending_task(self, backend):
         """
@@ -108,16 +824,126 @@ class FrontEnd(FirstBytesProtocol):
     
     def _sorter(self, backend):
         """
-        Sorts backends by the client-side task count.
+        Sorts backends by their load: the client-side task count, plus the 
+        tasks that other clients had running on the backend when the load 
+        monitor last checked.
+        """
+        return self.backends[backend] + self.remote_load.get(backend, 0)
+    
+    def _choose(self):
+        """
+        Used internally to yield the backends to try for a task, in order. The 
+        first is the less loaded of two random backends (the "power of two 
+        choices"), which is nearly as good as the least loaded one, but 
+        doesn't take a sort per call, and doesn't send every client to the 
+        same backend between monitor updates. The rest are only needed if it 
+        fails, and are yielded by load.
+        """
+        backends = self.backend_list
+        breakers = self.breakers
+        first = None
+        if len(backends) > 2:
+            first, second = random.sample(backends, 2)
+            if not breakers[first].up or (breakers[second].up and 
+                                          self._sorter(second) < 
+                                          self._sorter(first)):
+                first = second
+            if breakers[first].up:
+                yield first
+            else:
+                first = None
+        # Backends that are down are skipped altogether; they are being 
+        # probed.
+        for backend in sorted(backends, key=self._sorter):
+            if backend != first and breakers[backend].up:
+                yield backend
+    
+    def _failed(self, backend):
+        """
+        Used internally to count a connection failure for `backend`, starting 
+        to probe it if that took it down.
+        """
+        if self.breakers[backend].failed():
+            self.log(ERROR, 'Backend %s is down, skipping it' % (backend,))
+            threaded(self._probe, (backend,))
+    
+    def _probe(self, backend):
+        """
+        Used internally to try connecting to `backend`, which is down, with 
+        exponential backoff, until it comes back up.
+        """
+        breaker = self.breakers[backend]
+        while not breaker.up:
+            time.sleep(breaker.delay)
+            try:
+                sock = socket.create_connection(backend, breaker.delay)
+            except socket.error:
+                breaker.backoff()
+            else:
+                sock.close()
+                breaker.succeeded()
+                self.log(INFO, 'Backend %s is back up' % (backend,))
+    
+    def _poll_load(self, backend):
+        """
+        Used internally by the load monitor to find out how many tasks other 
+        clients have running or queued on `backend`. Returns DOWN_LOAD if it 
+        cannot be reached.
+        """
+        ours = self.backends[backend]
+        try:
+            try:
+                stats = self.send_signal(backend, STATS)
+                load = stats['tasks'] + stats['queued']
+            except BackendProcessingError:
+                # Older backends don't know STATS.
+                load = int(self.send_signal(backend, STATUS))
+        except BackendNotAvailableError:
+            return DOWN_LOAD
+        # The signal itself was counted as a task, and so were our own.
+        return max(load - 1 - ours, 0)
+    
+    def _monitor(self, generation):
+        """
+        The load monitor thread. Runs until start_monitor() or stop_monitor() 
+        is called again. A backend whose load can't be found out (e.g. one 
+        without the status task) is routed to as if it had none, and polled 
+        again next time.
+        """
+        while generation == self.monitor_generation:
+            for backend in list(self.backend_list):
+                try:
+                    load = self._poll_load(backend)
+                except Exception as e:
+                    self.log(ERROR, 'Could not get the load of backend %s: %r' 
+                                    % (backend, e))
+                    load = None
+                if generation != self.monitor_generation:
+                    return
+                if load is None:
+                    self.remote_load.pop(backend, None)
+                else:
+                    self.remote_load[backend] = load
+            time.sleep(self.monitor_interval)
+    
+    def _get_executor(self):
+        """
+        Get the executor to run on, or None if concurrent.futures is missing.
         """
-        return self.backends[backend]
+        if self.executor is not None:
+            return self.executor
+        try:
+            return get_executor()
+        except RuntimeError:
+            return None
     
-    def _do_cb(self, task, cb, error_cb, *args, **kw):
+    def _do_cb(self, cb, error_cb, get):
         """
-        Called internally by callback(). Does cb and error_cb selection.
+        Called internally by callback(), with a function that gets the result 
+        (or raises the error) of the task. Does cb and error_cb selection.
         """
         try:
-            res = self.work(task, *args, **kw)
+            res = get()
         except BackendProcessingError as e:
             if error_cb is None:
                 self.log(ERROR, e.__traceback__)
@@ -128,10 +954,10 @@ class FrontEnd(FirstBytesProtocol):
             # Success, let's call away!
             cb(res)
     
-    def _package(self, task, *args, **kw):
+    def _package(self, task, args=(), kw={}, rid=None):
         """
-        Used internally. Simply wraps the arguments up in a list and encodes 
-        the list.
+        Used internally. Simply wraps the arguments (and the request id, if 
+        there is one) up in a list and encodes the list.
         """
         # Implementation note: it is faster to use a tuple than a list here, 
         # because json does the list-like check like so (json/encoder.py:424):
@@ -147,41 +973,419 @@ class FrontEnd(FirstBytesProtocol):
         #   0.3031749725341797
         #   >>> timeit.timeit('L = [1,2,3]\nisinstance(L, (tuple, list))')
         #   0.6147568225860596
-        return self.codec.encode([task, args, kw])
+        if self.offers:
+            # Encoded once the codec of the backend is known.
+            if rid is None:
+                return _Call([task, args, kw])
+            return _Call([task, args, kw, rid])
+        if rid is None:
+            return self.codec.encode([task, args, kw])
+        return self.codec.encode([task, args, kw, rid])
+    
+    def _package_call(self, task, args, kw, inline=False):
+        """
+        Used internally to package a call to `task`, returning the package, 
+        its request id and the Streamed() arguments to send after it. Calls 
+        with Streamed() arguments are wrapped in a STREAM request, and are 
+        never multiplexed. Blob()s are sent by digest, unless `inline`.
+        """
+        uploads = []
+        if not _has_special(args, kw):
+            rid = self._next_id()
+            return self._package(task, args, kw, rid), rid, uploads
+        args, kw = self._placeholders(args, kw, uploads, inline)
+        if not uploads:
+            rid = self._next_id()
+            return self._package(task, args, kw, rid), rid, uploads
+        return self._package(STREAM, [task, args, kw]), None, uploads
+    
+    def _placeholders(self, args, kw, uploads, inline=False):
+        """
+        Used internally to swap the Streamed() and Blob() arguments of a call 
+        for their placeholders. Blob()s go along with Streamed() arguments, 
+        as the call can't be sent again once those are on their way.
+        """
+        inline = inline or _has_special(args, kw, Streamed)
+        args = [_placeholder(arg, uploads, self.codec, inline) 
+                for arg in args]
+        kw = dict((key, _placeholder(value, uploads, self.codec, inline)) 
+                  for key, value in kw.items())
+        return args, kw
+    
+    def _next_id(self):
+        """
+        Used internally to get a request id for a multiplexed request, or None 
+        if requests aren't multiplexed.
+        """
+        if self.multiplex:
+            # next() on a count is atomic, no locking needed.
+            return next(self.request_ids)
+        return None
+    
+    def _hello(self, pool, sock):
+        """
+        Used internally to open each new connection to the backend of `pool` 
+        with a HELLO handshake, settling the codec and FirstBytes version 
+        used with it. See the `codecs` argument.
+        """
+        self.send(sock, self.codec.encode([HELLO, [self.offers, [1, 2]], {}]))
+        self._agreed(pool, self.codec.decode(self.recv(sock)))
+    
+    def _agreed(self, pool, result):
+        """
+        Used internally to apply the backend's answer to a HELLO to `pool`.
+        """
+        if result[0] == 'success':
+            name, version = result[1]
+            pool.codec = self.offered.get(name, self.codec)
+            pool.version = version
+        else:
+            # Too old to know HELLO; there is no point in asking again.
+            self.log(INFO, 'Backend %s does not shake hands' % 
+                           (pool.backend,))
+            pool.handshake = None
+    
+    def _receive(self, conn, codec):
+        """
+        Used internally to receive one message from `conn` and decode it with 
+        `codec`.
+        """
+        incoming = self.recv(conn)
+        self.log(DEBUG, incoming)
+        return codec.decode(incoming)
+    
+    def _open(self, pool, package):
+        """
+        Used internally to send `package` over a connection from `pool` and 
+        receive the first message of the response, returning the connection 
+        and the decoded message. A pooled connection that turns out to be 
+        broken (e.g. the backend has closed it) while sending, or that the 
+        backend closes without a byte of response, is transparently replaced 
+        with a fresh one. Other errors are passed on, as they are on fresh 
+        connections, since the task may have run.
+        """
+        conn, reused = pool.get()
+        while 1:
+            try:
+                self.send(conn, _encoded(package, pool.codec), pool.version)
+            except socket.error:
+                conn.close()
+                if not reused:
+                    raise
+            except Exception:
+                conn.close()
+                raise
+            else:
+                if not reused:
+                    break
+                if _answered(conn):
+                    pool.keeps_alive = True
+                    break
+                conn.close()
+            # The backend can't act on a request that didn't get through 
+            # whole, and closes connections only between requests, so trying 
+            # again is safe.
+            if pool.keeps_alive is None:
+                self.log(INFO, 'Backend %s does not keep connections alive' % 
+                               (pool.backend,))
+                pool.keeps_alive = False
+            pool.clear()
+            conn, reused = pool.connect(), False
+        try:
+            return conn, self._receive(conn, pool.codec)
+        except Exception:
+            conn.close()
+            raise
+    
+    def _upload(self, pool, conn, uploads):
+        """
+        Used internally to send the chunks of the Streamed() arguments in 
+        `uploads` over `conn` as [index, items] messages, taking turns between 
+        them, each ending with [index, None]. Runs in its own thread, so that 
+        the response can be read at the same time.
+        """
+        sources = list(enumerate(upload.chunks() for upload in uploads))
+        try:
+            while sources:
+                for source in list(sources):
+                    index, chunks = source
+                    chunk = next(chunks, None)
+                    if chunk is None:
+                        sources.remove(source)
+                    self.send(conn, pool.codec.encode([index, chunk]), 
+                              pool.version)
+        except Exception:
+            # Make sure that both ends notice.
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+            raise
+    
+    def _open_upload(self, pool, package, uploads):
+        """
+        Used internally to send `package` over a new connection from `pool`, 
+        start sending `uploads` after it, and receive the first message of the 
+        response, returning the connection, the decoded message and the 
+        Resyncer() doing the upload.
+        """
+        conn = pool.connect()
+        uploader = Resyncer(self._upload, pool, conn, uploads)
+        try:
+            self.send(conn, _encoded(package, pool.codec), pool.version)
+        except Exception:
+            conn.close()
+            raise
+        uploader.start()
+        try:
+            return conn, self._receive(conn, pool.codec), uploader
+        except Exception:
+            self._check_upload(conn, uploader)
+            raise
+    
+    def _check_upload(self, conn, uploader):
+        """
+        Used internally to close `conn` after it broke, and raise the error 
+        that `uploader` failed with, if any, as it is what broke it. The 
+        uploader may not have finished failing by the time that the break is 
+        seen, so it is given a moment.
+        """
+        try:
+            # Wake up an upload that is still going, so that it fails soon.
+            conn.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        conn.close()
+        try:
+            uploader.get(UPLOAD_WAIT)
+        except (ResyncWaitTimeout, socket.error):
+            # Still going, or broken off by the shutdown; not the cause.
+            pass
+    
+    def _exchange(self, pool, package, uploads=None):
+        """
+        Used internally to send `package` and receive the decoded response 
+        over a connection from `pool`. The items of a streamed response are 
+        gathered up into a list.
+        """
+        if uploads:
+            return self._collect(self._exchange_stream(pool, package, 
+                                                       uploads))
+        conn, result = self._open(pool, package)
+        if result[0] == 'yield':
+            items = []
+            try:
+                while result[0] == 'yield':
+                    items.extend(result[1])
+                    result = self._receive(conn, pool.codec)
+            except Exception:
+                conn.close()
+                raise
+            if result[0] == 'success':
+                result = ['success', items]
+        pool.put(conn)
+        return result
+    
+    def _collect(self, messages):
+        """
+        Used internally to gather the items of the streamed response 
+        `messages` up into one response.
+        """
+        items = None
+        for result in messages:
+            if result[0] == 'yield':
+                if items is None:
+                    items = []
+                items.extend(result[1])
+        if items is not None and result[0] == 'success':
+            result = ['success', items]
+        return result
+    
+    def _exchange_stream(self, pool, package, uploads=None):
+        """
+        Used internally to send `package` (and `uploads`, if any) over a 
+        connection from `pool` and yield each decoded message of the response 
+        as it arrives. The connection goes back to the pool after the last 
+        one, or is closed if the stream is abandoned before then.
+        """
+        uploader = None
+        if uploads:
+            conn, result, uploader = self._open_upload(pool, package, uploads)
+        else:
+            conn, result = self._open(pool, package)
+        try:
+            while result[0] == 'yield':
+                yield result
+                result = self._receive(conn, pool.codec)
+            if uploader is not None:
+                # The backend has read it all by now.
+                uploader.get()
+        except BaseException as e:
+            if uploader is not None and isinstance(e, Exception):
+                self._check_upload(conn, uploader)
+            else:
+                conn.close()
+            raise
+        pool.put(conn)
+        yield result
+    
+    def _shared_connection(self, backend):
+        """
+        Used internally to pick the least busy multiplexed connection to 
+        `backend`, opening a new one if they are all busy and there is room, 
+        and closing ones that have been idle for too long.
+        """
+        limit = max(self.pool_size, 1)
+        cutoff = time.time() - self.pool_idle
+        stale = []
+        with self.shared_mutex:
+            conns = []
+            for conn in self.shared.get(backend, ()):
+                if conn.broken is not None:
+                    continue
+                if not len(conn) and conn.last_used < cutoff:
+                    stale.append(conn)
+                else:
+                    conns.append(conn)
+            self.shared[backend] = conns
+            best = min(conns, key=len) if conns else None
+        for conn in stale:
+            conn.close()
+        
+        if best is not None and (not len(best) or len(conns) >= limit):
+            return best
+        # Connect outside of the lock; a dead host may take a while.
+        pool = self.pools[backend]
+        sock = pool.connect()
+        conn = MultiplexedConnection(self, sock, pool.codec, pool.version)
+        with self.shared_mutex:
+            self.shared[backend].append(conn)
+        return conn
+    
+    def _exchange_shared(self, backend, rid, package):
+        """
+        Used internally to send `package` with the request id `rid` over a 
+        multiplexed connection to `backend`, and wait for the response.
+        """
+        conn = self._shared_connection(backend)
+        try:
+            mediator = conn.request(rid, package)
+        except (socket.error, FirstBytesCorruptionError):
+            # The backend dropped the connection before the request could go 
+            # out; one retry on a fresh connection is safe.
+            mediator = self._shared_connection(backend).request(rid, package)
+        return mediator.get()
+    
+    def _exchange_shared_stream(self, backend, rid, package):
+        """
+        Used internally to send `package` with the request id `rid` over a 
+        multiplexed connection to `backend`, and yield each message of the 
+        response as it arrives.
+        """
+        conn = self._shared_connection(backend)
+        try:
+            channel = conn.request(rid, package, True)
+        except (socket.error, FirstBytesCorruptionError):
+            channel = self._shared_connection(backend).request(rid, package, 
+                                                               True)
+        for message in channel:
+            yield message
     
-    def _work(self, backend, package, ident='', log=True):
+    def _work(self, backend, package, ident='', log=True, rid=None, 
+              uploads=None):
         """
         Centralized task worker code. Used internally, see send_signal() and 
-        work() for the external interfaces.
+        work() for the external interfaces. `rid` must be the request id that 
+        `package` was packaged with, if any, and `uploads` the Streamed() 
+        arguments to send after it.
         """
         num = self._sending_task(backend)
+        # Don't format messages that nobody will see.
+        log = log and self.log is not null_logger
         if log:
             self.log(INFO, 'Starting %s backend task #%s (%s)' % 
                            (backend, num, ident))
         try:
-            conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            conn.connect(backend)
-            self.send(conn, package)
-            result = self.recv(conn)
-            self.log(DEBUG, result)
-            result = self.codec.decode(result)
+            if rid is None:
+                result = self._exchange(self.pools[backend], package, uploads)
+            else:
+                result = self._exchange_shared(backend, rid, package)
         except Exception as e:
             self._canceling_task(backend)
+            if isinstance(e, socket.error):
+                self._failed(backend)
             raise
         else:
             self._closing_task(backend)
+            self.breakers[backend].succeeded()
             if log:
                 self.log(INFO, 'Finished %s backend task #%s (%s)' % 
                                (backend, num, ident))
-        finally:
-            conn.close()
         
         if result[0] == 'error':
+            if result[1] == BUSY:
+                raise BackendBusyError
             # We reraise errors in our own way.
             raise BackendProcessingError(*result[1:])
         else:
             return result[1]
     
+    def _work_stream(self, backend, package, ident='', rid=None, 
+                     uploads=None):
+        """
+        The streaming counterpart of _work(), yielding each message of the 
+        response as it arrives.
+        """
+        num = self._sending_task(backend)
+        self.log(INFO, 'Starting %s backend stream #%s (%s)' % 
+                       (backend, num, ident))
+        if rid is None:
+            messages = self._exchange_stream(self.pools[backend], package, 
+                                             uploads)
+        else:
+            messages = self._exchange_shared_stream(backend, rid, package)
+        try:
+            for message in messages:
+                if message[0] != 'yield':
+                    break
+                yield message
+        except socket.error:
+            self._canceling_task(backend)
+            self._failed(backend)
+            raise
+        except BaseException:
+            # Including an abandoned stream; the backend did the work anyway.
+            messages.close()
+            self._closing_task(backend)
+            raise
+        self._closing_task(backend)
+        self.breakers[backend].succeeded()
+        self.log(INFO, 'Finished %s backend stream #%s (%s)' % 
+                       (backend, num, ident))
+        yield message
+    
+    def _stream_items(self, message, messages):
+        """
+        Used internally to turn the messages of a streamed response, starting 
+        with `message`, into the items of the result.
+        """
+        try:
+            while 1:
+                if message[0] == 'yield':
+                    for item in message[1]:
+                        yield item
+                elif message[0] == 'success':
+                    # A task that returned e.g. a list rather than a generator.
+                    if message[1] is not None:
+                        for item in message[1]:
+                            yield item
+                    return
+                else:
+                    raise BackendProcessingError(*message[1:])
+                message = next(messages)
+        finally:
+            messages.close()
+    
     def send_signal(self, backend, signal):
         """
         Sends the `signal` signal to `backend`. Raises ValueError if `backend` 
@@ -190,7 +1394,9 @@ class FrontEnd(FirstBytesProtocol):
         backend = self._expand_host(backend)
         if backend in self.backends:
             try:
-                return self._work(backend, self._package(signal), log=False)
+                rid = self._next_id()
+                return self._work(backend, self._package(signal, rid=rid), 
+                                  log=False, rid=rid)
             except socket.error:
                 raise BackendNotAvailableError
         else:
@@ -208,6 +1414,13 @@ class FrontEnd(FirstBytesProtocol):
         """
         self.send_signal(backend, KILL)
     
+    def send_flush(self, backend):
+        """
+        Sends the FLUSH signal to `backend`, emptying its cache of the results 
+        of memoized tasks.
+        """
+        self.send_signal(backend, FLUSH)
+    
     def get_tasks(self, backend):
         """
         Gets a string of the tasks running on `backend`. This string will 
@@ -232,6 +1445,32 @@ class FrontEnd(FirstBytesProtocol):
             res = 'down'
         return res
 
+    def get_stats(self, backend):
+        """
+        Gets a dict of statistics from `backend` (see `BackEnd.stats()`), or 
+        None if the backend is down. Raises ValueError if `backend` is not 
+        registered with the client.
+        """
+        try:
+            return self.send_signal(backend, STATS)
+        except BackendNotAvailableError:
+            return None
+    
+    def get_health(self, backend=None):
+        """
+        Gets a dict describing the health of `backend` (see 
+        `BackendHealth.as_dict()`), or, if `backend` is not given, a dict of 
+        these for all backends. Raises ValueError if `backend` is not 
+        registered with the client.
+        """
+        if backend is None:
+            return dict((backend, breaker.as_dict()) 
+                        for backend, breaker in self.breakers.items())
+        backend = self._expand_host(backend)
+        if backend not in self.breakers:
+            raise ValueError('No such backend!')
+        return self.breakers[backend].as_dict()
+    
     def add_backends(self, *backends):
         """
         See the documentation for __init__() to see an explanation of the 
@@ -239,8 +1478,15 @@ class FrontEnd(FirstBytesProtocol):
         """
         for backend in backends:
             full = self._expand_host(backend)
+            if full not in self.backends:
+                self.backend_list.append(full)
             self.backends[full] = 0
+            self.breakers[full] = BackendHealth(self.failure_limit, 
+                                                self.retry)
             self.task_counter[full] = 0
+            self.pools[full] = ConnectionPool(
+              full, self.pool_size, self.pool_idle, self.codec, self.version, 
+              self._hello if self.offers else None)
     
     def work(self, task, *args, **kw):
         """
@@ -266,37 +1512,262 @@ class FrontEnd(FirstBytesProtocol):
           'TypeError'
           >>> e.args
           ["'int' object is not iterable"]
-        """
-        package = self._package(task, *args, **kw)
-        backends = sorted(self.backends, key=self._sorter)
         
-        for backend in backends:
+        Iterables and files wrapped in Streamed() are sent piece by piece; see 
+        `Streamed()`. Large arguments wrapped in Blob() are sent to each 
+        backend only once; see `Blob()`.
+        """
+        if self.coalescer is not None and not _has_special(args, kw):
+            return self.coalescer.call(task, args, kw)
+        return self._work_routed(task, args, kw)
+    
+    def _work_routed(self, task, args, kw):
+        """
+        Used internally to run a task on the best backend that will take it. 
+        See work().
+        """
+        package, rid, uploads = self._package_call(task, args, kw)
+        return self._route(task, package, rid, uploads, (args, kw))
+    
+    def _route(self, task, package, rid=None, uploads=(), call=None):
+        """
+        Used internally to send `package`, a call to `task` packaged with the 
+        request id `rid` (and followed by `uploads`), to the best backend that 
+        will take it. `call` is the (args, kw) of the call, for packaging it 
+        again with its Blob()s, should the backend be missing any.
+        """
+        for backend in self._choose():
             try:
-                return self._work(backend, package, task)
-            except socket.error:
+                try:
+                    return self._work(backend, package, task, rid=rid, 
+                                      uploads=uploads)
+                except BackendProcessingError as e:
+                    if e.type != MISSING_BLOB or call is None:
+                        raise
+                # Send them along, to this backend and any after it.
+                package, rid, uploads = self._package_call(task, call[0], 
+                                                           call[1], True)
+                return self._work(backend, package, task, rid=rid, 
+                                  uploads=uploads)
+            except (socket.error, BackendBusyError):
                 # We want to just move onto the next backend if we couldn't 
-                # connect to this one
-                pass
+                # connect to this one, or if it is too busy -- unless some of 
+                # the input is gone already.
+                if any(upload.started for upload in uploads):
+                    raise
         # Didn't not get a backend, let the caller know!
         raise BackendNotAvailableError
     
+    def prepare(self, task):
+        """
+        Get a PreparedTask() for calling `task` over and over with less 
+        overhead than work():
+          add = frontend.prepare('add')
+          total = sum(add(i, i) for i in range(100000))
+        """
+        return PreparedTask(self, task)
+    
+    def _chunks(self, task, iterable, chunksize):
+        """
+        Used internally to split starmap() arguments up into lists of 
+        [task, args, kw] calls for BATCH.
+        """
+        chunk = []
+        for args in iterable:
+            chunk.append([task, list(args), {}])
+            if len(chunk) >= chunksize:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+    
+    def _unpack_batch(self, responses, return_errors):
+        """
+        Used internally to turn the responses from a BATCH into results. Errors 
+        are raised, or, if `return_errors`, returned.
+        """
+        results = []
+        for res in responses:
+            if res[0] == 'success':
+                results.append(res[1])
+                continue
+            e = BackendProcessingError(*res[1:])
+            if not return_errors:
+                raise e
+            results.append(e)
+        return results
+    
+    def _map_chunk(self, index, chunk, done):
+        """
+        Used internally by starmap() to run a chunk, putting an 
+        (index, responses, error) triple in the `done` queue.
+        """
+        try:
+            done.put((index, self._work_routed(BATCH, [chunk], {}), None))
+        except Exception as e:
+            done.put((index, None, e))
+    
+    def starmap(self, task, iterable, chunksize=CHUNKSIZE, ordered=True, 
+                return_errors=False):
+        """
+        Like map(), except that each item of `iterable` is a sequence of the 
+        arguments to call `task` with, as in `itertools.starmap()`.
+        """
+        chunks = self._chunks(task, iterable, chunksize)
+        # Keep a couple of chunks in flight for each backend, so that none 
+        # sits idle waiting on us.
+        window = max(2 * len(self.backend_list), 2)
+        done = Queue()
+        finished = {}
+        sent = 0
+        wanted = 0
+        for index, chunk in enumerate(itertools.islice(chunks, window)):
+            threaded(self._map_chunk, (index, chunk, done))
+            sent += 1
+        while wanted < sent:
+            index, responses, error = done.get()
+            if error is not None:
+                raise error
+            for chunk in itertools.islice(chunks, 1):
+                threaded(self._map_chunk, (sent, chunk, done))
+                sent += 1
+            if not ordered:
+                wanted += 1
+                for res in self._unpack_batch(responses, return_errors):
+                    yield res
+                continue
+            finished[index] = responses
+            while wanted in finished:
+                responses = finished.pop(wanted)
+                wanted += 1
+                for res in self._unpack_batch(responses, return_errors):
+                    yield res
+    
+    def map(self, task, iterable, chunksize=CHUNKSIZE, ordered=True, 
+            return_errors=False):
+        """
+        Call `task` with each item of `iterable`, yielding the results. The 
+        calls are sent `chunksize` at a time, each chunk in a single message 
+        run as a batch by the backend, and the chunks are spread across the 
+        backends. Much faster than calling work() for each item when there 
+        are many small calls.
+        
+        ordered       -- If False, results are yielded as soon as their chunk 
+                         comes back, rather than in the order of `iterable`.
+        return_errors -- If True, a call that fails yields its 
+                         BackendProcessingError instead of raising it, so 
+                         that the other results are not lost.
+        
+        Requires backends that know BATCH.
+        """
+        return self.starmap(task, ((arg,) for arg in iterable), chunksize, 
+                            ordered, return_errors)
+    
+    def stream(self, task, *args, **kw):
+        """
+        Run `task` with `args` and `kw` on a backend, returning an iterator 
+        over the items of its result. The items of a task that returns a 
+        generator (or any other iterator) are sent back as they are produced, 
+        so the first of them can be used right away, and neither end has to 
+        hold the whole result in memory. Other iterable results work too, just 
+        without those gains. An error raised by the task, even partway 
+        through, is raised as a BackendProcessingError() when it is reached.
+        
+        Streams are not coalesced, and a backend is only failed over from 
+        before the first items have arrived. Abandoning a stream closes its 
+        connection, which stops the task on the backend, except for 
+        multiplexed connections, where the rest of the items are dropped as 
+        they arrive.
+        """
+        # A stream can't be asked for again, so Blob()s always go along.
+        package, rid, uploads = self._package_call(task, args, kw, True)
+        for backend in self._choose():
+            messages = self._work_stream(backend, package, task, rid, uploads)
+            try:
+                message = next(messages)
+            except socket.error:
+                if any(upload.started for upload in uploads):
+                    raise
+                continue
+            if message[0] == 'error' and message[1] == BUSY:
+                messages.close()
+                continue
+            return self._stream_items(message, messages)
+        raise BackendNotAvailableError
+    
     def callback(self, task, cb, error_cb, *args, **kw):
         """
-        Threads the task, then runs a callback on success or an error callback
-        on fail.
+        Runs the task on the executor, then runs a callback on success or an 
+        error callback on fail.
         
         cb       -- The function to be called with a successful result.
         error_cb -- The function to be called when an error occurs.
         
         For information on `task`, *args, and **kw, see work().
         """
-        threaded(self._do_cb, (task, cb, error_cb) + args, kw)
+        executor = self._get_executor()
+        if executor is None:
+            threaded(self._do_cb, (cb, error_cb, 
+                                   functools.partial(self.work, task, *args, 
+                                                     **kw)))
+            return
+        future = executor.submit(self.work, task, *args, **kw)
+        future.add_done_callback(
+          lambda future: self._do_cb(cb, error_cb, future.result))
     
     def ignore(self, task, *args, **kw):
         """
-        Thread it and forget it.
+        Run it on the executor and forget it.
         
         For information on the arguments to this method, see work().
         """
         # We want to silence errors
         self.callback(task, null_cb, False, *args, **kw)
+    
+    def submit(self, task, *args, **kw):
+        """
+        Run the task on the executor, returning a `concurrent.futures.Future()` 
+        for its result, which may be waited on, cancelled, or combined with 
+        others through `concurrent.futures.wait()` and `as_completed()`. 
+        
+        For information on the arguments to this method, see work().
+        """
+        executor = self._get_executor()
+        if executor is None:
+            raise RuntimeError('submit() requires concurrent.futures')
+        return executor.submit(self.work, task, *args, **kw)
+    
+    def start_monitor(self, interval):
+        """
+        Start polling each backend for its load every `interval` seconds, in 
+        a background thread. work() then takes into account the tasks that 
+        other clients are running on each backend, without asking the 
+        backends on every call. Backends that can't be reached are avoided 
+        until they can be again. Replaces any monitor already running.
+        """
+        self.monitor_interval = interval
+        self.monitor_generation += 1
+        threaded(self._monitor, (self.monitor_generation,))
+    
+    def stop_monitor(self):
+        """
+        Stop the load monitor, and forget what it found out.
+        """
+        self.monitor_interval = None
+        self.monitor_generation += 1
+        self.remote_load = {}
+    
+    def close(self):
+        """
+        Close all pooled and multiplexed connections, and stop the load 
+        monitor. The FrontEnd may still be used afterwards; new connections 
+        will be opened as needed.
+        """
+        self.stop_monitor()
+        for pool in self.pools.values():
+            pool.clear()
+        with self.shared_mutex:
+            shared, self.shared = self.shared, {}
+        for conns in shared.values():
+            for conn in conns:
+                conn.close()
@@ -62,11 +62,23 @@ See also the resync.py example script.
 """
 
 import time
+import functools
+import itertools
+import threading
+from collections import deque
+try:
+    from queue import Queue, Empty
+except ImportError:
+    # Python 2
+    from Queue import Queue, Empty
 
 from .threaded import *
 
 
-__all__ = ['ResyncWaitTimeout', 'Mediator', 'Resyncer']
+__all__ = ['ResyncWaitTimeout', 'ChannelClosed', 'Mediator', 'Resyncer', 
+           'Channel', 'ResyncPool', 'wait_any', 'wait_all', 'as_completed']
+
+POOL_WORKERS = 8
 
 
 class ResyncWaitTimeout(error):
@@ -79,6 +91,14 @@ class ResyncWaitTimeout(error):
         error.__init__(self, 'Could not acquire lock within the time allotted')
 
 
+class ChannelClosed(Exception):
+    
+    """
+    An error raised when putting into a closed `Channel()`, or getting from 
+    one that has been closed and emptied.
+    """
+
+
 class Mediator(object):
     
     """
@@ -89,8 +109,24 @@ class Mediator(object):
         self._lock = allocate_lock()
         # Do it here, to avoid problems later
         self._lock.acquire()
-        
+        self._done = False
+        self._callbacks = []
+        self._cb_mutex = allocate_lock()
+    
     def _wait(self, timeout):
+        """
+        Acquire the lock within `timeout` seconds, or raise 
+        ResyncWaitTimeout(). Wakes up as soon as the result is set.
+        """
+        try:
+            acquired = self._lock.acquire(True, max(timeout, 0))
+        except TypeError:
+            # Python 2 locks can't time out.
+            return self._poll(timeout)
+        if not acquired:
+            raise ResyncWaitTimeout
+    
+    def _poll(self, timeout):
         """
         Based upon an extract from threading.Condition().wait(). Immediately 
         tries to acquire the lock, and then sleeps for a period of time (going 
@@ -113,7 +149,36 @@ class Mediator(object):
             delay = min(delay * 2, remaining, .05)
             time.sleep(delay)
         raise ResyncWaitTimeout
-        
+    
+    def _finish(self, result):
+        """
+        Store the result, wake up the get()ter, and run the done callbacks.
+        """
+        self.result = result
+        with self._cb_mutex:
+            self._done = True
+            callbacks, self._callbacks = self._callbacks, []
+        self._lock.release()
+        for fn in callbacks:
+            fn(self)
+    
+    def done(self):
+        """
+        Whether a result or an error has been set.
+        """
+        return self._done
+    
+    def add_done_callback(self, fn):
+        """
+        Call `fn` with this Mediator once a result or an error has been set, 
+        or right away if one already has. Used by wait_any(), wait_all() and 
+        as_completed().
+        """
+        with self._cb_mutex:
+            if not self._done:
+                self._callbacks.append(fn)
+                return
+        fn(self)
     
     def set_result(self, res):
         """
@@ -122,8 +187,7 @@ class Mediator(object):
         the end, either set_result() or self_error() must be called, or the 
         the get()ing side will hang.
         """
-        self.result = (True, res)
-        self._lock.release()
+        self._finish((True, res))
     
     def set_error(self, e):
         """
@@ -131,13 +195,13 @@ class Mediator(object):
         within thread, the worker thread should call this function with an 
         error class or instance.
         """
-        self.result = (False, e)
-        self._lock.release()
+        self._finish((False, e))
     
     def get(self, timeout=None):
         """
         Get a result or raise an error. If `timeout` is not None, this function 
-        will wait for only `timeout` seconds before raising ThreadTimeout().
+        will wait for only `timeout` seconds before raising 
+        ResyncWaitTimeout().
         """
         if timeout is None:
             self._lock.acquire()
@@ -178,14 +242,339 @@ class Resyncer(object):
         else:
             self.mediator.set_result(res)
     
-    def start(self):
+    def start(self, pool=None):
         """
-        Start the resync'd function.
+        Start the resync'd function, in a thread of its own, or on the 
+        `ResyncPool()` `pool`.
         """
-        threaded(self._wrapper, ())
+        if pool is None:
+            threaded(self._wrapper, ())
+        else:
+            pool.jobs.put(self._wrapper)
     
     def get(self, timeout=None):
         """
         Get the result of the resync'd function. Simply calls Mediator().get().
         """
         return self.mediator.get(timeout)
+    
+    def done(self):
+        """
+        Whether the resync'd function has finished.
+        """
+        return self.mediator.done()
+    
+    def add_done_callback(self, fn):
+        """
+        Call `fn` with this Resyncer once the resync'd function has finished.
+        """
+        self.mediator.add_done_callback(lambda mediator: fn(self))
+
+
+class Channel(object):
+    
+    """
+    A thread-safe, optionally bounded stream of values from any number of 
+    producers to any number of consumers; the many-result counterpart of 
+    `Mediator()`. 
+    
+    >>> channel = Channel(100)
+    >>> @taskit
+    ... def produce(n):
+    ...     channel.put_many(range(n))
+    ...     channel.close()
+    ...
+    >>> produce.ignore(1000)
+    >>> sum(channel)
+    499500
+    
+    A producer that fails can pass the error to close(), and consumers will 
+    get it raised once they have gotten everything put before it.
+    """
+    
+    def __init__(self, size=0):
+        """
+        size -- The most values held at once. put()s wait for room beyond 
+                that. 0 means no limit.
+        """
+        self.size = size
+        self._items = deque()
+        self._mutex = threading.Lock()
+        self._not_empty = threading.Condition(self._mutex)
+        self._not_full = threading.Condition(self._mutex)
+        self._closed = False
+        self._error = None
+    
+    def __len__(self):
+        return len(self._items)
+    
+    def __iter__(self):
+        """
+        Get values until the channel is closed and empty.
+        """
+        while 1:
+            try:
+                yield self.get()
+            except ChannelClosed:
+                return
+    
+    def _room(self):
+        if not self.size:
+            return float('inf')
+        return self.size - len(self._items)
+    
+    def _wait(self, condition, ready, endtime):
+        """
+        Wait on `condition` until `ready()` is true, raising 
+        ResyncWaitTimeout() past `endtime` (None for never). Must be called 
+        with the mutex held.
+        """
+        while not ready():
+            if endtime is None:
+                condition.wait()
+                continue
+            remaining = endtime - time.time()
+            if remaining <= 0:
+                raise ResyncWaitTimeout
+            condition.wait(remaining)
+    
+    def _check_open(self):
+        if self._closed:
+            raise ChannelClosed('Channel is closed')
+    
+    def _check_empty(self):
+        """
+        Raise the appropriate error for a closed and empty channel.
+        """
+        if self._error is not None:
+            raise self._error
+        raise ChannelClosed('Channel is closed')
+    
+    def put(self, item, timeout=None):
+        """
+        Put `item` into the channel, waiting for room for up to `timeout` 
+        seconds if it is full. Raises ChannelClosed() if the channel is 
+        closed.
+        """
+        with self._mutex:
+            if self.size and len(self._items) >= self.size:
+                endtime = None if timeout is None else time.time() + timeout
+                self._wait(self._not_full, 
+                           lambda: self._closed or self._room() > 0, endtime)
+            self._check_open()
+            self._items.append(item)
+            self._not_empty.notify()
+    
+    def put_many(self, items, timeout=None):
+        """
+        Put all of `items` into the channel, taking the lock once for as many 
+        as there is room for, rather than once for each. Waits for room up to 
+        `timeout` seconds in all; if that runs out, the items already put 
+        stay put. Raises ChannelClosed() if the channel is closed.
+        """
+        items = list(items)
+        endtime = None if timeout is None else time.time() + timeout
+        with self._mutex:
+            while items:
+                self._wait(self._not_full, 
+                           lambda: self._closed or self._room() > 0, endtime)
+                self._check_open()
+                room = self._room()
+                if room >= len(items):
+                    chunk, items = items, []
+                else:
+                    chunk, items = items[:room], items[room:]
+                self._items.extend(chunk)
+                if len(chunk) > 1:
+                    self._not_empty.notify_all()
+                else:
+                    self._not_empty.notify()
+    
+    def get(self, timeout=None):
+        """
+        Get the next value, waiting up to `timeout` seconds for one. Once the 
+        channel has been closed and emptied, raises the error that it was 
+        closed with, or else ChannelClosed().
+        """
+        with self._mutex:
+            if not self._items:
+                endtime = None if timeout is None else time.time() + timeout
+                self._wait(self._not_empty, 
+                           lambda: self._closed or self._items, endtime)
+                if not self._items:
+                    self._check_empty()
+            item = self._items.popleft()
+            self._not_full.notify()
+        return item
+    
+    def get_many(self, max_items=None, timeout=None):
+        """
+        Get a list of up to `max_items` (default: all) waiting values, 
+        waiting up to `timeout` seconds for at least one. Raises like get().
+        """
+        endtime = None if timeout is None else time.time() + timeout
+        with self._mutex:
+            self._wait(self._not_empty, 
+                       lambda: self._closed or self._items, endtime)
+            if not self._items:
+                self._check_empty()
+            items = self._items
+            if max_items is None or max_items >= len(items):
+                got = list(items)
+                items.clear()
+            else:
+                got = [items.popleft() for i in range(max_items)]
+            if len(got) > 1:
+                self._not_full.notify_all()
+            else:
+                self._not_full.notify()
+        return got
+    
+    def close(self, error=None):
+        """
+        Close the channel; nothing more may be put into it, and consumers 
+        stop once they have gotten everything already in it. If `error` is 
+        given, they then get it raised instead of ChannelClosed().
+        """
+        with self._mutex:
+            self._closed = True
+            self._error = error
+            self._not_empty.notify_all()
+            self._not_full.notify_all()
+    
+    def closed(self):
+        """
+        Whether the channel has been closed.
+        """
+        return self._closed
+
+
+class ResyncPool(object):
+    
+    """
+    A fixed set of worker threads that resync'd calls are run on, rather than 
+    on a thread each.
+    
+    >>> pool = ResyncPool(4)
+    >>> resyncer = pool.submit(len, 'Python+TaskIt')
+    >>> resyncer.get()
+    13
+    >>> list(pool.map(abs, range(-3, 3)))
+    [3, 2, 1, 0, 1, 2]
+    """
+    
+    def __init__(self, workers=POOL_WORKERS, queue_size=0):
+        """
+        workers    -- The number of worker threads. 
+        queue_size -- The most calls that may wait for a worker; submitting 
+                      more waits for room. 0 means no limit.
+        """
+        self.workers = workers
+        self.jobs = Channel(queue_size)
+        for i in range(workers):
+            threaded(self._worker, ())
+    
+    def _worker(self):
+        # Jobs catch their own errors.
+        for job in self.jobs:
+            job()
+    
+    def _run_chunk(self, func, pairs):
+        """
+        Call `func` with each item of a chunk of (mediator, item) pairs, 
+        handing each its result or error.
+        """
+        for mediator, item in pairs:
+            try:
+                res = func(item)
+            except Exception as e:
+                mediator.set_error(e)
+            else:
+                mediator.set_result(res)
+    
+    def _results(self, mediators, return_errors):
+        for mediator in mediators:
+            try:
+                yield mediator.get()
+            except Exception as e:
+                if not return_errors:
+                    raise
+                yield e
+    
+    def submit(self, func, *args, **kw):
+        """
+        Start `func(*args, **kw)` on the pool, returning its `Resyncer()`.
+        """
+        resyncer = Resyncer(func, *args, **kw)
+        resyncer.start(self)
+        return resyncer
+    
+    def map(self, func, iterable, chunksize=1, return_errors=False):
+        """
+        Call `func` with each item of `iterable` on the pool, `chunksize` 
+        items to a job, and return an iterator over the results, in order. 
+        All of the calls are started right away. An item whose call failed 
+        raises its error when reached, just like `Mediator.get()`, unless 
+        `return_errors` is True, in which case the error is yielded instead.
+        """
+        mediators = []
+        iterable = iter(iterable)
+        while 1:
+            chunk = list(itertools.islice(iterable, chunksize))
+            if not chunk:
+                break
+            pairs = [(Mediator(), item) for item in chunk]
+            mediators.extend(mediator for mediator, item in pairs)
+            self.jobs.put(functools.partial(self._run_chunk, func, pairs))
+        return self._results(mediators, return_errors)
+    
+    def close(self):
+        """
+        Stop the workers once the calls already started have finished.
+        """
+        self.jobs.close()
+
+
+def as_completed(waitables, timeout=None):
+    """
+    Yield each of the `Mediator()`s and `Resyncer()`s in `waitables` as soon 
+    as it is done, waking up only when one is. Raises ResyncWaitTimeout() if 
+    they aren't all done within `timeout` seconds. A single thread may use 
+    this to wait on any number of results:
+    
+    >>> for resyncer in as_completed(resyncers):
+    ...     print(resyncer.get())
+    """
+    waitables = list(waitables)
+    finished = Queue()
+    for waitable in waitables:
+        waitable.add_done_callback(finished.put)
+    if timeout is not None:
+        endtime = time.time() + timeout
+    for i in range(len(waitables)):
+        if timeout is None:
+            yield finished.get()
+            continue
+        try:
+            yield finished.get(True, max(endtime - time.time(), 0))
+        except Empty:
+            raise ResyncWaitTimeout
+
+
+def wait_any(waitables, timeout=None):
+    """
+    Wait until any of the `Mediator()`s and `Resyncer()`s in `waitables` is 
+    done, and return it. Raises ResyncWaitTimeout() if none is done within 
+    `timeout` seconds.
+    """
+    for waitable in as_completed(waitables, timeout):
+        return waitable
+
+
+def wait_all(waitables, timeout=None):
+    """
+    Wait until all of the `Mediator()`s and `Resyncer()`s in `waitables` are 
+    done. Raises ResyncWaitTimeout() if they aren't within `timeout` seconds.
+    """
+    for waitable in as_completed(waitables, timeout):
+        pass
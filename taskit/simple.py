@@ -4,12 +4,27 @@ Twisted, but is much simpler, more Pythonistic, and event-loop-less.
 """
 
 import sys
+import functools
+try:
+    from concurrent.futures import (Future, ThreadPoolExecutor, 
+                                    ProcessPoolExecutor)
+except ImportError:
+    # Python 2 without the futures backport; no submit(), and callback() 
+    # starts a thread per call.
+    Future = ThreadPoolExecutor = ProcessPoolExecutor = None
 
 from .threaded import *
 from .common import show_err
 
 
-__all__ = ['null_cb', 'taskit', 'Task']
+__all__ = ['null_cb', 'InlineExecutor', 'get_executor', 'set_executor', 
+           'get_process_executor', 'taskit', 'Task']
+
+EXECUTOR_WORKERS = 32
+
+_executor = None
+_process_executor = None
+_executor_mutex = allocate_lock()
 
 
 def null_cb(arg):
@@ -19,14 +34,73 @@ def null_cb(arg):
     pass
 
 
-def taskit(func):
+class InlineExecutor(object):
+    
     """
-    Shortcut for a standard subclass of Task(). Can be used as a decorator.
+    An executor that runs each call right away, in the calling thread, and 
+    hands back an already finished Future. Useful in tests, and for tasks too 
+    quick to be worth handing to another thread.
     """
-    class NewTask(Task):
-        def work(self, *args, **kw):
-            return func(*args, **kw)
-    return NewTask()
+    
+    def submit(self, fn, *args, **kw):
+        if Future is None:
+            raise RuntimeError('InlineExecutor requires concurrent.futures')
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kw))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+    
+    def shutdown(self, wait=True):
+        pass
+
+
+def get_executor():
+    """
+    Get the shared executor that submit() methods run on by default, starting 
+    it if need be. It is a `concurrent.futures.ThreadPoolExecutor()` with 
+    EXECUTOR_WORKERS threads.
+    """
+    global _executor
+    if _executor is None:
+        if ThreadPoolExecutor is None:
+            raise RuntimeError('submit() requires concurrent.futures')
+        with _executor_mutex:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(EXECUTOR_WORKERS)
+    return _executor
+
+
+def set_executor(executor):
+    """
+    Replace the shared executor with any `concurrent.futures.Executor()`, 
+    returning the old one (or None) so that it can be shut down. To use 
+    another executor for a single Task or FrontEnd, set its `executor` 
+    attribute instead.
+    """
+    global _executor
+    with _executor_mutex:
+        old, _executor = _executor, executor
+    return old
+
+
+def get_process_executor():
+    """
+    Get a shared `concurrent.futures.ProcessPoolExecutor()`, with a process 
+    per CPU, starting it if need be. Good for CPU-bound tasks; their 
+    arguments and results must be picklable, and so must the tasks 
+    themselves, which is the case for module-level functions decorated with 
+    @taskit.
+    """
+    global _process_executor
+    if _process_executor is None:
+        if ProcessPoolExecutor is None:
+            raise RuntimeError('Process executors require concurrent.futures')
+        with _executor_mutex:
+            if _process_executor is None:
+                _process_executor = ProcessPoolExecutor()
+    return _process_executor
 
 
 class Task(object):
@@ -36,6 +110,10 @@ class Task(object):
     something useful.
     """
     
+    # The executor that submit() and callback() run on; None means the 
+    # shared one.
+    executor = None
+    
     def work(self, *args, **kw):
         """
         This method is what is Taskified. Override it. A caller can use this to 
@@ -43,12 +121,23 @@ class Task(object):
         """
         pass
     
-    def _do_cb(self, cb, error_cb, *args, **kw):
+    def _get_executor(self):
         """
-        Called internally by callback(). Does cb and error_cb selection.
+        Get the executor to run on, or None if concurrent.futures is missing.
+        """
+        if self.executor is not None:
+            return self.executor
+        if ThreadPoolExecutor is None:
+            return None
+        return get_executor()
+    
+    def _do_cb(self, cb, error_cb, get):
+        """
+        Called internally by callback(), with a function that gets the result 
+        (or raises the error) of the task. Does cb and error_cb selection.
         """
         try:
-            res = self.work(*args, **kw)
+            res = get()
         except Exception as e:
             if error_cb is None:
                 show_err()
@@ -60,14 +149,69 @@ class Task(object):
     
     def callback(self, cb, error_cb, *args, **kw):
         """
-        Threads the task, then runs a callback on success or an error callback
-        on fail.
+        Runs the task on the executor, then runs a callback on success or an 
+        error callback on fail. If `error_cb` is None, errors are printed; if 
+        it is False, they are ignored.
         """
-        threaded(self._do_cb, (cb, error_cb) + args, kw)
+        executor = self._get_executor()
+        if executor is None:
+            threaded(self._do_cb, 
+                     (cb, error_cb, functools.partial(self.work, *args, **kw)))
+            return
+        future = executor.submit(self.work, *args, **kw)
+        future.add_done_callback(
+          lambda future: self._do_cb(cb, error_cb, future.result))
     
     def ignore(self, *args, **kw):
         """
-        Thread it and forget it.
+        Run it on the executor and forget it.
         """
         # We want to silence errors
         self.callback(null_cb, False, *args, **kw)
+    
+    def submit(self, *args, **kw):
+        """
+        Run the task on the executor, returning a `concurrent.futures.Future()` 
+        for its result, which may be waited on, cancelled, or combined with 
+        others through `concurrent.futures.wait()` and `as_completed()`.
+        """
+        executor = self._get_executor()
+        if executor is None:
+            raise RuntimeError('submit() requires concurrent.futures')
+        return executor.submit(self.work, *args, **kw)
+
+
+class _FunctionTask(Task):
+    
+    """
+    What taskit() makes of a function.
+    """
+    
+    def __init__(self, func, executor):
+        self.func = func
+        self.executor = executor
+        self.__name__ = func.__name__
+        self.__module__ = func.__module__
+        self.__doc__ = func.__doc__
+    
+    def work(self, *args, **kw):
+        return self.func(*args, **kw)
+    
+    def __reduce__(self):
+        # Used as a decorator, we have taken the function's place in its 
+        # module, so pickle (and so process executors) can find us there.
+        return getattr(self.func, '__qualname__', self.__name__)
+
+
+def taskit(func=None, executor=None):
+    """
+    Shortcut for a standard subclass of Task(). Can be used as a decorator, 
+    optionally giving the executor for submit() and callback():
+    
+    >>> @taskit(executor=get_process_executor())
+    ... def crunch(numbers):
+    ...     return sum(n ** 2 for n in numbers)
+    """
+    if func is None:
+        return lambda func: taskit(func, executor)
+    return _FunctionTask(func, executor)